@@ -1,13 +1,21 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog, colorchooser
 from tkinter.scrolledtext import ScrolledText
-import requests
+import http_pool
+from request_core import get_core, iter_resilient_deltas, TkBridge, STREAM_BUFFER_SIZE
+from response_cache import ResponseCache, cache_key, format_cache_stats, DEFAULT_TTL_HOURS, DEFAULT_MAX_MB
+from model_catalog import ModelCatalog
+from context_budget import (count_tokens, context_budget, assemble_context, needs_summary, summary_batch_tokens,
+                            turns_to_summarize, summary_request, MESSAGE_OVERHEAD_TOKENS, SUMMARY_KEEP_RECENT)
 import os
 import json
 import sqlite3
 import argparse
 import sys
 import re
+import threading
+import time
+import queue
 from markdown import markdown
 from html.parser import HTMLParser
 from tkinter import PhotoImage
@@ -15,6 +23,53 @@ from dotenv import load_dotenv
 from tkinter import font
 from PIL import Image
 from rag.rag_manager import RAGManager
+from chat_import import read_chat_export, import_chat_files, format_import_stats
+from chat_db import (
+    set_db_path,
+    close_db,
+    queue_message,
+    queue_input_history,
+    flush_writes,
+    INPUT_HISTORY_LIMIT,
+    init_db,
+    save_system_prompt,
+    get_system_prompts,
+    delete_system_prompt,
+    get_setting,
+    get_setting_bool,
+    get_setting_int,
+    save_setting,
+    get_sessions,
+    create_session,
+    import_session,
+    set_body_compression,
+    compact_message_bodies,
+    update_session_model,
+    update_session_system_prompt,
+    update_session_system_prompt_id,
+    update_session_parent,
+    get_messages,
+    get_messages_after,
+    get_message_token_counts,
+    queue_token_counts,
+    get_session_summary,
+    save_session_summary,
+    has_earlier_messages,
+    save_message,
+    get_message_ids_for_source,
+    delete_messages,
+    get_input_history,
+    update_session_name,
+    get_session_subtree,
+    delete_session_tree,
+    get_inactive_sessions,
+    archive_sessions,
+    get_archived_sessions,
+    rehydrate_session,
+    vacuum_db,
+    search_messages,
+    count_messages_from,
+)
 from bs4 import BeautifulSoup
 import platform
 
@@ -31,7 +86,7 @@ def initialize_rag():
     """Initializes RAG functions if enabled in settings."""
     global rag_functions
     # Default to 'true' if setting doesn't exist
-    if get_setting("enable_rag", "true") == "True":
+    if get_setting_bool("enable_rag", True):
         try:
             from rag.rag import (
                 get_rag_processor,
@@ -40,6 +95,7 @@ def initialize_rag():
                 get_files_for_chat,
                 delete_file_from_chat,
                 delete_source_from_chat,
+                delete_chats_from_rag,
                 query_by_chat_id,
                 unload_rag_processor,
                 is_rag_loaded,
@@ -51,6 +107,7 @@ def initialize_rag():
             rag_functions['get_files_for_chat'] = get_files_for_chat
             rag_functions['delete_file_from_chat'] = delete_file_from_chat
             rag_functions['delete_source_from_chat'] = delete_source_from_chat
+            rag_functions['delete_chats_from_rag'] = delete_chats_from_rag
             rag_functions['query_by_chat_id'] = query_by_chat_id
             rag_functions['unload_rag_processor'] = unload_rag_processor
             rag_functions['is_rag_loaded'] = is_rag_loaded
@@ -77,7 +134,7 @@ def fetch_url_text(url: str) -> str:
         "Connection": "keep-alive",
         "Upgrade-Insecure-Requests": "1",
     }
-    resp = requests.get(url, headers=headers, allow_redirects=True, timeout=10)
+    resp = http_pool.get(url, headers=headers, allow_redirects=True, timeout=10)
     resp.raise_for_status()
     soup = BeautifulSoup(resp.text, "html.parser")
     return soup.get_text(separator="\n")
@@ -101,6 +158,27 @@ RECENT_DBS = []
 WINDOW_GEOMETRY_FILE = "window_geometries.json"
 WINDOW_GEOMETRIES = {}
 
+# Number of messages rendered when a session is opened, and added each time
+# "Load earlier messages" is clicked.
+HISTORY_PAGE_SIZE = 100
+
+# Messages read at a time, newest first, when assembling a request's context.
+CONTEXT_PAGE_SIZE = 50
+
+# Tokens of the newest messages sent when asking for a session name. The name
+# only follows the current topic, so the rest of the history is left out.
+RENAME_CONTEXT_TOKENS = 1500
+
+# Streamed tokens are collected and drawn at most this many times per second.
+# Fast models emit hundreds of deltas a second; drawing them one by one costs
+# far more than the eye can see, so each frame inserts everything that arrived
+# since the previous one in a single call.
+STREAM_FRAME_RATE = 30
+STREAM_FRAME_MS = 1000 // STREAM_FRAME_RATE
+
+# Appended to a reply that was stopped before the model finished it.
+TRUNCATED_MARKER = "\n\n*[Response stopped]*"
+
 def load_recent_dbs():
     """Load the list of recently used database files."""
     if os.path.exists(RECENT_DB_FILE):
@@ -141,242 +219,29 @@ def save_window_geometries(data):
     except Exception:
         pass
 
+def fetch_proxy_models(etag=None):
+    """Fetch the model ids from the proxy, or (None, etag) if they have not changed since ``etag``."""
+    print(f"Fetching available models from {API_URL}/mods, PROXY_VERIFY_CERT={PROXY_VERIFY_CERT}")
+    headers = {"x-api-secret": API_SECRET}
+    if etag:
+        headers["If-None-Match"] = etag
+    response = http_pool.get(f"{API_URL}/mods", headers=headers, verify=PROXY_VERIFY_CERT)
+    if response.status_code == 304:
+        return None, etag
+    response.raise_for_status()
+    models = response.json()
+    # The structure from the proxy is already a list of model objects
+    return [model['id'] for model in models['data']], response.headers.get("ETag")
+
+# The proxy's model list, cached on disk and refreshed in the background so
+# startup and imports never wait for it.
+model_catalog = ModelCatalog(API_URL, fetch_proxy_models)
+
 def get_available_models():
-    try:
-        print(f"Fetching available models from {API_URL}/mods, PROXY_VERIFY_CERT={PROXY_VERIFY_CERT}")
-        response = requests.get(f"{API_URL}/mods", headers={"x-api-secret": API_SECRET},verify=PROXY_VERIFY_CERT)
-        response.raise_for_status()
-        models = response.json()
-        # The structure from the proxy is already a list of model objects
-        available_models = sorted([model['id'] for model in models['data']]) #if "gpt" in model['id']])
-        return available_models
-    except Exception as e:
-        print(f"Error fetching models: {e}")
-        return ["gpt-3.5-turbo"] # Fallback to a default model
-
-# --- Database ---
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS system_prompts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL UNIQUE,
-                    prompt TEXT NOT NULL
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    model TEXT DEFAULT 'gpt-3.5-turbo',
-                    system_prompt TEXT,
-                    system_prompt_id INTEGER,
-                    parent_id INTEGER,
-                    type TEXT DEFAULT 'chat',
-                    FOREIGN KEY(parent_id) REFERENCES sessions(id)
-                )''')
-    c.execute("PRAGMA table_info(sessions)")
-    cols = [row[1] for row in c.fetchall()]
-    if 'system_prompt_id' not in cols:
-        c.execute('ALTER TABLE sessions ADD COLUMN system_prompt_id INTEGER')
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-                    session_id INTEGER,
-                    role TEXT,
-                    content TEXT,
-                    FOREIGN KEY(session_id) REFERENCES sessions(id)
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS input_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    session_id INTEGER,
-                    content TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(session_id) REFERENCES sessions(id)
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
-                )''')
-    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('enable_rag', 'true')")
-    conn.commit()
-    conn.close()
-
-def save_system_prompt(title, prompt):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO system_prompts (title, prompt) VALUES (?, ?)", (title, prompt))
-    conn.commit()
-    conn.close()
-
-def get_system_prompts():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, title, prompt FROM system_prompts ORDER BY title")
-    prompts = c.fetchall()
-    conn.close()
-    return prompts
-
-def delete_system_prompt(prompt_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM system_prompts WHERE id = ?", (prompt_id,))
-    conn.commit()
-    conn.close()
-
-def get_setting(key, default=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else default
-
-def save_setting(key, value):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
-    conn.commit()
-    conn.close()
-
-def get_sessions():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, name, model, system_prompt, system_prompt_id, parent_id, type FROM sessions ORDER BY id")
-    sessions = c.fetchall()
-    conn.close()
-    return sessions
-
-def create_session(name, model='gpt-3.5-turbo', system_prompt='', type='chat', parent_id=None, system_prompt_id=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO sessions (name, model, system_prompt, system_prompt_id, type, parent_id) VALUES (?, ?, ?, ?, ?, ?)",
-        (name, model, system_prompt, system_prompt_id, type, parent_id),
-    )
-    conn.commit()
-    session_id = c.lastrowid
-    conn.close()
-    return session_id
-
-
-def update_session_model(session_id, model):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET model = ? WHERE id = ?", (model, session_id))
-    conn.commit()
-    conn.close()
-
-
-def update_session_system_prompt(session_id, system_prompt):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET system_prompt = ? WHERE id = ?", (system_prompt, session_id))
-    conn.commit()
-    conn.close()
-
-def update_session_system_prompt_id(session_id, prompt_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET system_prompt_id = ? WHERE id = ?", (prompt_id, session_id))
-    conn.commit()
-    conn.close()
-
-def get_messages(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT role, content FROM messages WHERE session_id = ?", (session_id,))
-    messages = c.fetchall()
-    conn.close()
-    return messages
-
-def save_message(session_id, role, content):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, role, content))
-    conn.commit()
-    conn.close()
-
-def delete_message_by_content(session_id, content):
-    """Delete messages matching the given content for a session."""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE session_id = ? AND content = ?", (session_id, content))
-    conn.commit()
-    conn.close()
-
-def save_input_history(session_id, content):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("INSERT INTO input_history (session_id, content) VALUES (?, ?)", (session_id, content))
-    conn.commit()
-    conn.close()
-
-def get_input_history(session_id, limit=25):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT content FROM input_history WHERE session_id = ? ORDER BY timestamp DESC LIMIT ?", (session_id, limit))
-    history = [row[0] for row in c.fetchall()]
-    conn.close()
-    return list(reversed(history))
-
-def delete_input_history_for_session(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM input_history WHERE session_id = ?", (session_id,))
-    conn.commit()
-    conn.close()
-
-def update_session_name(session_id, new_name):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE sessions SET name = ? WHERE id = ?", (new_name, session_id))
-    conn.commit()
-    conn.close()
-
-def delete_session_and_messages(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-    c.execute("DELETE FROM input_history WHERE session_id = ?", (session_id,))
-    c.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    conn.commit()
-    conn.close()
+    return model_catalog.models(default=["gpt-3.5-turbo"]) # Fallback to a default model until the list is fetched
 
 # --- API ---
-def stream_and_process_response(resp, widget):
-    assistant_full_reply = ""
-    buffer = ""
-    for line in resp.iter_lines():
-        if line:
-            decoded_line = line.decode('utf-8')
-            if decoded_line.startswith("data: "):
-                json_data = decoded_line[len("data: "):]
-                if json_data == "[DONE]":
-                    break
-                try:
-                    data = json.loads(json_data)
-                    if 'choices' in data and len(data['choices']) > 0:
-                        delta = data['choices'][0]['delta']
-                        if 'content' in delta:
-                            content_chunk = delta['content']
-                            assistant_full_reply += content_chunk
-                            buffer += content_chunk
-                            if widget:
-                                # This is a simplified approach for real-time rendering.
-                                # For a more robust solution, you might need to parse the buffer
-                                # and apply tags incrementally.
-                                widget.configure(state="normal")
-                                widget.insert(tk.END, content_chunk)
-                                widget.see(tk.END)
-                                widget.update_idletasks()
-                except json.JSONDecodeError:
-                    print(f"Skipping non-JSON line: {decoded_line}")
-    
-    # Final rendering after the stream is complete
-    if widget:
-        # This is where you could re-render the whole response for accuracy
-        pass
-
-    return assistant_full_reply
-
-def send_to_api(session_name, messages, model, current_session_id, widget=None, save_message_to_db=True):
+def send_to_api(session_name, messages, model, current_session_id, save_message_to_db=True):
     payload = {
         "model": model,
         "messages": messages,
@@ -387,23 +252,60 @@ def send_to_api(session_name, messages, model, current_session_id, widget=None,
         "x-api-secret": API_SECRET
     }
 
-    assistant_full_reply = ""
-    if widget:
-        widget.configure(state="normal")
-        widget.insert(tk.END, "Assistant:\n", ("assistant_tag")) # Start assistant message
-        widget.see(tk.END)
-        widget.update_idletasks()
+    # Retries failed connections and resumes a reply whose stream drops midway.
+    deltas = iter_resilient_deltas(f"{API_URL}/v1/chat/completions", payload, headers=headers,
+                                   verify=PROXY_VERIFY_CERT, on_retry=print)
+    assistant_full_reply = "".join(deltas)
 
-    with requests.post(f"{API_URL}/v1/chat/completions", json=payload, headers=headers, stream=True, verify=PROXY_VERIFY_CERT) as resp:
-        resp.raise_for_status()
-        assistant_full_reply = stream_and_process_response(resp, widget)
-    
     # Save the complete assistant reply after streaming is done
     if save_message_to_db:
-        save_message(current_session_id, "assistant", assistant_full_reply)
+        queue_message(current_session_id, "assistant", assistant_full_reply)
     return assistant_full_reply
 
 
+class ChatStream:
+    """One assistant reply being streamed for a chat session.
+
+    The request runs on the shared RequestCore. Deltas arrive on ``events``,
+    which is bounded so a busy UI holds back the network reader, and the UI
+    thread drains it once per frame.
+    """
+
+    def __init__(self, session_id, messages, model):
+        self.session_id = session_id
+        self.messages = messages
+        self.model = model
+        self.events = queue.Queue(maxsize=STREAM_BUFFER_SIZE)
+        self.handle = None
+        # When set, a completed reply is stored in the response cache under this key.
+        self.cache_key = None
+        # Set when the user stops the reply, so what arrived is kept.
+        self.stopped = False
+        # Reply received so far. Only the UI thread reads or updates it.
+        self.text = ""
+        # Used by the UI thread to name the reply's tags while it is on screen.
+        self.key = f"stream_{id(self)}"
+        self.renderer = None
+        self.body_start = None
+        # Rendering statistics, kept by the UI thread.
+        self.started = time.perf_counter()
+        self.deltas = 0
+        self.frames = 0
+        self.render_seconds = 0.0
+
+    def start(self):
+        payload = {"model": self.model, "messages": self.messages}
+        headers = {"Content-Type": "application/json", "x-api-secret": API_SECRET}
+        self.handle = get_core().stream_chat(
+            f"{API_URL}/v1/chat/completions", payload, self.events,
+            headers=headers, verify=PROXY_VERIFY_CERT,
+        )
+
+    def cancel(self):
+        if self.handle:
+            self.handle.cancel()
+
+
 class HTMLToTkinter(HTMLParser):
     def __init__(self, text_widget):
         super().__init__()
@@ -558,6 +460,69 @@ def render_markdown_in_widget(widget, md):
     parser = HTMLToTkinter(widget)
     parser.feed(html)
 
+_FENCE_LINE = re.compile(r"^\s*(```|~~~)")
+# Lines that may continue the block before a blank line: indented text, list
+# items and table rows. A block is only treated as finished once the line
+# after the blank line shows it cannot continue.
+_CONTINUATION_LINE = re.compile(r"^(\s|[-*+]\s|\d+[.)]\s|\|)")
+
+def split_finished_markdown(text):
+    """Find where the finished markdown blocks at the start of ``text`` end.
+
+    Returns ``(end, rest)``: ``text[:end]`` holds complete blocks that will
+    render the same whatever follows, and the unfinished remainder starts at
+    ``text[rest]``. Both are 0 while no block is finished.
+    """
+    end = rest = pos = 0
+    in_fence = False
+    blank_start = None
+    # The last line may still be growing, so only whole lines are considered.
+    for line in text.split("\n")[:-1]:
+        if in_fence:
+            if _FENCE_LINE.match(line):
+                in_fence = False
+        elif not line.strip():
+            if blank_start is None:
+                blank_start = pos
+        else:
+            if blank_start is not None and not _CONTINUATION_LINE.match(line):
+                end, rest = blank_start, pos
+            blank_start = None
+            if _FENCE_LINE.match(line):
+                in_fence = True
+        pos += len(line) + 1
+    return end, rest
+
+
+class StreamingMarkdown:
+    """Render markdown that arrives in pieces at the end of a Text widget.
+
+    Finished blocks are rendered once and left alone. Only the trailing
+    unfinished block is deleted and rendered again as more text arrives, so
+    each update costs the size of one block, not of the whole reply.
+    """
+
+    def __init__(self, widget, mark):
+        self.widget = widget
+        self.mark = mark
+        self.pending = ""
+        widget.mark_set(mark, "end-1c")
+        widget.mark_gravity(mark, tk.LEFT)
+
+    def feed(self, text):
+        self.pending += text
+        end, rest = split_finished_markdown(self.pending)
+        self.widget.delete(self.mark, tk.END)
+        if rest:
+            finished, self.pending = self.pending[:end], self.pending[rest:]
+            if finished.strip():
+                render_markdown_in_widget(self.widget, finished)
+                # markdown puts a newline between blocks; supply it here since
+                # the blocks are rendered separately.
+                self.widget.insert(tk.END, "\n")
+            self.widget.mark_set(self.mark, "end-1c")
+        render_markdown_in_widget(self.widget, self.pending)
+
 
 
 class ToolTip:
@@ -624,16 +589,24 @@ class ChatApp(tk.Tk):
         init_db()
         self.session_id = None
         self.session_name = None
+        self.history_limit = HISTORY_PAGE_SIZE
+        # Replies being streamed, by session. Each chat can have one reply in
+        # flight while other chats and background requests keep running.
+        self.active_streams = {}
+        self.bridge = TkBridge(self)
+        self.response_cache = None
+        # Sessions whose summary is being rebuilt in the background.
+        self.summarizing = set()
         self.message_history = []
         self.history_index = -1
         self.chat_files = []
-        self.rag_enabled = get_setting("enable_rag", "True") == "True"
+        self.rag_enabled = get_setting_bool("enable_rag", True)
         
         self.theme = tk.StringVar(value=get_setting("theme", "light"))
         self.chat_font = tk.StringVar(value=get_setting("chat_font", "TkDefaultFont"))
-        self.chat_font_size = tk.IntVar(value=get_setting("chat_font_size", 10))
+        self.chat_font_size = tk.IntVar(value=get_setting_int("chat_font_size", 10))
         self.ui_font = tk.StringVar(value=get_setting("ui_font", "TkDefaultFont"))
-        self.ui_font_size = tk.IntVar(value=get_setting("ui_font_size", 12))
+        self.ui_font_size = tk.IntVar(value=get_setting_int("ui_font_size", 12))
         self.selection_bg = tk.StringVar(value=get_setting("selection_bg", "#b2d7ff"))
         self.selection_fg = tk.StringVar(value=get_setting("selection_fg", "black"))
         self.current_system_prompt_id = None
@@ -654,6 +627,7 @@ class ChatApp(tk.Tk):
         self.bind("<Control-equal>", self.increase_font_size)
         self.bind("<Control-minus>", self.decrease_font_size)
         self.bind("<Control-f>", self.find_dialog)
+        self.bind("<Control-F>", self.open_search_all_dialog)
         self.search_matches = []
         self.current_match_index = -1
         self.drag_item = None
@@ -716,6 +690,8 @@ class ChatApp(tk.Tk):
             args = [python_exe, script_path, "--db", db_path]
 
         print("Restarting with:", args)
+        flush_writes()
+        close_db()
         os.execl(python_exe, *args)
 
     def on_close(self):
@@ -726,9 +702,19 @@ class ChatApp(tk.Tk):
             self.rag_manager.close()
         WINDOW_GEOMETRIES[DB_PATH] = self.geometry()
         save_window_geometries(WINDOW_GEOMETRIES)
+        get_core().cancel_all()
+        flush_writes()
+        close_db()
+        http_pool.close_session()
+        if self.response_cache:
+            print(format_cache_stats(self.response_cache.stats()))
+            self.response_cache.close()
         self.destroy()
         sys.exit(0)
 
+    def on_models_updated(self, models):
+        self.model_dropdown['values'] = models
+
     def on_model_selected(self, event):
         if self.session_id:
             selected_model = self.model_var.get()
@@ -833,11 +819,7 @@ class ChatApp(tk.Tk):
             self.clear_tags_recursively(child)
 
     def update_item_parent(self, item_id, parent_id):
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("UPDATE sessions SET parent_id = ? WHERE id = ?", (parent_id, item_id))
-        conn.commit()
-        conn.close()
+        update_session_parent(item_id, parent_id)
 
     def get_open_folders(self, item, open_folders):
         if self.session_tree.item(item, "open"):
@@ -861,8 +843,10 @@ class ChatApp(tk.Tk):
 
         if item_type == 'folder':
             self.session_context_menu.entryconfig("New Chat", state="normal")
+            self.session_context_menu.entryconfig("Archive", state="disabled")
         else:
             self.session_context_menu.entryconfig("New Chat", state="disabled")
+            self.session_context_menu.entryconfig("Archive", state="normal")
 
         self.session_context_menu.post(event.x_root, event.y_root)
 
@@ -906,39 +890,33 @@ class ChatApp(tk.Tk):
         session_id = int(session_id)
         session_name = self.session_tree.item(selected_item, "text")
 
+        do_delete = False
         if type == 'folder':
-            # Simple folder deletion: only if it's empty
-            if not self.session_tree.get_children(selected_item):
-                if messagebox.askyesno("Delete Folder", f"Are you sure you want to delete the empty folder '{session_name}'?"):
-                    delete_session_and_messages(session_id)
-                    self.session_tree.delete(selected_item)
+            subtree = get_session_subtree(session_id)
+            chat_count = sum(1 for _id, item_type in subtree if item_type != 'folder')
+            if len(subtree) == 1:
+                prompt = f"Are you sure you want to delete the empty folder '{session_name}'?"
             else:
-                messagebox.showinfo("Delete Folder", "Cannot delete a folder that is not empty.")
-            return
-
-        messages = get_messages(session_id)
-        
-        do_delete = False
-        if not messages: # If the session is empty, delete without confirmation
+                prompt = (f"Are you sure you want to delete the folder '{session_name}' and everything in it "
+                          f"({chat_count} chats, {len(subtree) - 1 - chat_count} subfolders)?")
+            do_delete = messagebox.askyesno("Delete Folder", prompt)
+        elif not get_messages(session_id, limit=1): # If the session is empty, delete without confirmation
             do_delete = True
         elif messagebox.askyesno("Delete Session", f"Are you sure you want to delete session '{session_name}' and all its messages?"):
             do_delete = True
 
         if do_delete:
+            deleted_ids = delete_session_tree(session_id)
+            self.cancel_streams(deleted_ids)
+            self.session_tree.delete(selected_item)
+
             if rag_functions:
                 try:
-                    files_to_delete = rag_functions['get_files_for_chat'](session_id)
-                    if files_to_delete:
-                        for file_path in files_to_delete:
-                            rag_functions['delete_file_from_chat'](file_path, chat_id=session_id)
-                        self.show_status_message(f"Deleted {len(files_to_delete)} associated files from RAG.")
+                    rag_functions['delete_chats_from_rag'](deleted_ids)
                 except Exception as e:
                     self.show_status_message(f"Error deleting RAG files: {e}")
 
-            delete_session_and_messages(session_id)
-            self.session_tree.delete(selected_item)
-
-            if self.session_id == session_id:
+            if self.session_id in deleted_ids:
                 self.session_id = None
                 self.session_name = None
                 self.chat_history.configure(state="normal")
@@ -1011,6 +989,7 @@ class ChatApp(tk.Tk):
         self.model_dropdown = ttk.Combobox(self.left_frame, textvariable=self.model_var, state="readonly")
         self.model_dropdown.grid(row=3, column=0, sticky="ew", padx=10, pady=2)
         self.model_dropdown['values'] = get_available_models()
+        model_catalog.add_listener(self.bridge.wrap(self.on_models_updated))
         self.model_dropdown.set("gpt-3.5-turbo")
         self.model_dropdown.bind('<<ComboboxSelected>>', self.on_model_selected)
 
@@ -1036,10 +1015,15 @@ class ChatApp(tk.Tk):
         self.session_context_menu.add_command(label="New Folder", command=self.create_folder_from_context)
         self.session_context_menu.add_command(label="Rename", command=self.rename_session)
         self.session_context_menu.add_command(label="Delete", command=self.delete_session)
+        self.session_context_menu.add_command(label="Archive", command=self.archive_selected_session)
 
         self.whitespace_context_menu = tk.Menu(self.session_tree, tearoff=0)
         self.whitespace_context_menu.add_command(label="New Chat", command=lambda: self.new_session(parent_id=None))
         self.whitespace_context_menu.add_command(label="New Folder", command=lambda: self.new_folder(parent_id=None))
+        self.whitespace_context_menu.add_command(label="Import Folder of Chats...", command=lambda: self.import_chat_folder(parent_id=None))
+        self.whitespace_context_menu.add_separator()
+        self.whitespace_context_menu.add_command(label="Archive Inactive Chats...", command=self.archive_inactive_chats)
+        self.whitespace_context_menu.add_command(label="Archived Chats...", command=self.open_archived_chats_dialog)
 
         self.new_button = ttk.Button(self.left_frame, text="+ New", command=self.new_session)
         self.new_button.grid(row=5, column=0, sticky="ew", padx=10, pady=(0, 2))
@@ -1079,6 +1063,8 @@ class ChatApp(tk.Tk):
         self.next_button.pack(side=tk.LEFT)
         self.prev_button = ttk.Button(self.search_frame, text="Prev", command=self.find_prev)
         self.prev_button.pack(side=tk.LEFT)
+        self.all_chats_button = ttk.Button(self.search_frame, text="All Chats", command=lambda: self.open_search_all_dialog(query=self.search_entry.get()))
+        self.all_chats_button.pack(side=tk.LEFT)
         self.close_button = ttk.Button(self.search_frame, text="X", command=self.hide_search)
         self.close_button.pack(side=tk.LEFT)
         self.search_frame.grid_remove() # Hide by default
@@ -1103,6 +1089,7 @@ class ChatApp(tk.Tk):
 
         self.chat_history_menu = tk.Menu(self.chat_history, tearoff=0)
         self.chat_history_menu.add_command(label="Copy", command=self.copy_chat_selection)
+        self.chat_history_menu.add_command(label="Delete Message", command=self.delete_message_at_context)
         self.chat_history.bind("<Button-3>", self.show_chat_context_menu)
 
         self.selection_context_menu = tk.Menu(self.chat_history, tearoff=0)
@@ -1179,10 +1166,12 @@ class ChatApp(tk.Tk):
         )
         self.input_box.grid(row=0, column=0, rowspan=2, sticky="nsew")
         self.input_box.bind("<Control-Return>", self.send_message)
+        self.input_box.bind("<Escape>", self.stop_generation)
         self.input_box.bind("<Up>", self.history_up_wrapper)
         self.input_box.bind("<Down>", self.history_down_wrapper)
 
-        self.send_button = ttk.Button(self.input_container_frame, text="Send", command=self.send_message)
+        # Becomes a Stop button while the current chat's reply is streaming.
+        self.send_button = ttk.Button(self.input_container_frame, text="Send", command=self.on_send_button)
         self.send_button.grid(row=0, column=1, sticky="nsew")
 
         # Files button directly below Send, no gap
@@ -1413,7 +1402,7 @@ class ChatApp(tk.Tk):
     def open_settings(self):
         settings_win = tk.Toplevel(self)
         settings_win.title("Settings")
-        settings_win.geometry("700x700")
+        settings_win.geometry("700x920")
 
         if self.theme.get() == "dark":
             settings_win.configure(bg="#2b2b2b")
@@ -1544,12 +1533,211 @@ class ChatApp(tk.Tk):
             messagebox.showinfo("Restart Required", "Please restart the application for the RAG setting to take effect.", parent=settings_win)
         ttk.Checkbutton(settings_win, variable=rag_var, command=on_rag_toggle).grid(row=18, column=0, sticky="w", padx=20)
 
+        # Compressed message storage
+        ttk.Label(settings_win, text="Compress and deduplicate large messages:").grid(row=19, column=0, sticky="w", pady=5, padx=20)
+        compress_var = tk.BooleanVar(value=get_setting_bool("compress_messages"))
+        def on_compress_toggle():
+            save_setting("compress_messages", compress_var.get())
+            set_body_compression(compress_var.get())
+            if compress_var.get() and messagebox.askyesno(
+                "Compress Messages",
+                "Compress existing messages now as well? This runs in the background.",
+                parent=settings_win,
+            ):
+                threading.Thread(target=self.compact_existing_messages, daemon=True).start()
+        ttk.Checkbutton(settings_win, variable=compress_var, command=on_compress_toggle).grid(row=20, column=0, sticky="w", padx=20)
+
+        # Cold storage
+        ttk.Label(settings_win, text="Archive chats inactive for (days):").grid(row=21, column=0, sticky="w", pady=5, padx=20)
+        archive_days = tk.IntVar(value=get_setting_int("archive_after_days", 90))
+        def on_archive_days_change(*args):
+            try:
+                save_setting("archive_after_days", archive_days.get())
+            except tk.TclError:
+                pass
+        ttk.Spinbox(settings_win, from_=1, to=3650, textvariable=archive_days, command=on_archive_days_change).grid(row=22, column=0, sticky="ew", padx=20)
+        archive_days.trace_add("write", on_archive_days_change)
+
+        # Reply cache for selection actions
+        ttk.Label(settings_win, text="Cache replies to selection actions:").grid(row=23, column=0, sticky="w", pady=5, padx=20)
+        cache_var = tk.BooleanVar(value=get_setting_bool("response_cache"))
+        cache_frame = ttk.Frame(settings_win)
+        cache_frame.grid(row=24, column=0, sticky="ew", padx=20)
+        cache_ttl = tk.IntVar(value=get_setting_int("response_cache_ttl_hours", DEFAULT_TTL_HOURS))
+        cache_max_mb = tk.IntVar(value=get_setting_int("response_cache_max_mb", DEFAULT_MAX_MB))
+        cache_stats = ttk.Label(settings_win, text="")
+        cache_stats.grid(row=25, column=0, sticky="w", padx=20)
+
+        def show_cache_stats():
+            cache = self.get_response_cache()
+            cache_stats.config(text=format_cache_stats(cache.stats()) if cache else "")
+
+        def on_cache_change(*args):
+            try:
+                save_setting("response_cache", cache_var.get())
+                save_setting("response_cache_ttl_hours", cache_ttl.get())
+                save_setting("response_cache_max_mb", cache_max_mb.get())
+            except tk.TclError:
+                return
+            cache = self.get_response_cache()
+            if cache:
+                cache.ttl_hours = cache_ttl.get()
+                cache.max_mb = cache_max_mb.get()
+            show_cache_stats()
+
+        def clear_cache():
+            cache = self.get_response_cache()
+            if cache:
+                cache.clear()
+            show_cache_stats()
+
+        ttk.Checkbutton(cache_frame, variable=cache_var, command=on_cache_change).pack(side=tk.LEFT)
+        ttk.Label(cache_frame, text="TTL (hours):").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(cache_frame, from_=1, to=8760, width=6, textvariable=cache_ttl, command=on_cache_change).pack(side=tk.LEFT)
+        ttk.Label(cache_frame, text="Max MB:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(cache_frame, from_=1, to=10000, width=6, textvariable=cache_max_mb, command=on_cache_change).pack(side=tk.LEFT)
+        ttk.Button(cache_frame, text="Clear", command=clear_cache).pack(side=tk.LEFT, padx=(10, 0))
+        cache_ttl.trace_add("write", on_cache_change)
+        cache_max_mb.trace_add("write", on_cache_change)
+        show_cache_stats()
+
+        # Context budget
+        ttk.Label(settings_win, text="Max context tokens per request (0 = model limit):").grid(row=26, column=0, sticky="w", pady=5, padx=20)
+        context_tokens = tk.IntVar(value=get_setting_int("context_budget_tokens", 0))
+        def on_context_tokens_change(*args):
+            try:
+                save_setting("context_budget_tokens", context_tokens.get())
+            except tk.TclError:
+                pass
+        ttk.Spinbox(settings_win, from_=0, to=2000000, increment=1024, textvariable=context_tokens, command=on_context_tokens_change).grid(row=27, column=0, sticky="ew", padx=20)
+        context_tokens.trace_add("write", on_context_tokens_change)
+
+        ttk.Label(settings_win, text="Summarize older messages of long chats:").grid(row=28, column=0, sticky="w", pady=5, padx=20)
+        summaries_var = tk.BooleanVar(value=get_setting_bool("rolling_summaries", True))
+        ttk.Checkbutton(settings_win, variable=summaries_var,
+                        command=lambda: save_setting("rolling_summaries", summaries_var.get())).grid(row=29, column=0, sticky="w", padx=20)
+
+    def compact_existing_messages(self):
+        """Move large stored messages into compressed storage. Runs on a worker thread."""
+        try:
+            moved, before, after = compact_message_bodies()
+            summary = f"Compressed {moved} messages: {before // 1024} KB -> {after // 1024} KB"
+        except sqlite3.Error as e:
+            summary = f"Message compression failed: {e}"
+        print(summary)
+        self.bridge.call(self.show_status_message, summary, 6000)
+
+    def archive_selected_session(self):
+        selection = self.session_tree.selection()
+        if not selection:
+            return
+        session_id, item_type = self.session_tree.item(selection[0], "values")
+        if item_type == 'folder':
+            return
+        self.archive_chats([int(session_id)])
+
+    def archive_inactive_chats(self):
+        days = get_setting_int("archive_after_days", 90)
+        session_ids = get_inactive_sessions(days)
+        if not session_ids:
+            messagebox.showinfo("Archive Chats", f"No chats have been inactive for more than {days} days.")
+            return
+        if messagebox.askyesno(
+            "Archive Chats",
+            f"Move {len(session_ids)} chats inactive for more than {days} days to the archive?\n\n"
+            "Archived chats can be restored from 'Archived Chats...'.",
+        ):
+            self.archive_chats(session_ids, vacuum=True)
+
+    def archive_chats(self, session_ids, vacuum=False):
+        """Move chats to the archive database and drop them from the tree."""
+        self.cancel_streams(session_ids)
+        if self.session_id in session_ids:
+            self.session_id = None
+            self.session_name = None
+            self.chat_history.configure(state="normal")
+            self.chat_history.delete("1.0", tk.END)
+            self.update_input_widgets_state()
+        try:
+            count = archive_sessions(session_ids)
+        except sqlite3.Error as e:
+            messagebox.showerror("Archive Chats", f"Could not archive chats: {e}")
+            return
+        for session_id in session_ids:
+            item = self.find_tree_item_by_id(session_id)
+            if item:
+                self.session_tree.delete(item)
+        self.show_status_message(f"Archived {count} chats.")
+        if vacuum:
+            # Give the freed space back so the main database file shrinks.
+            threading.Thread(target=self.vacuum_database, daemon=True).start()
+
+    def vacuum_database(self):
+        """Rebuild the main database file. Runs on a worker thread."""
+        try:
+            vacuum_db()
+        except sqlite3.Error as e:
+            print(f"Database vacuum failed: {e}")
+
+    def open_archived_chats_dialog(self):
+        """List archived chats and restore the chosen one into the main database."""
+        if hasattr(self, 'archive_window') and self.archive_window.winfo_exists():
+            self.archive_window.lift()
+        else:
+            self.archive_window = tk.Toplevel(self)
+            self.archive_window.title("Archived Chats")
+            self.archive_window.geometry("600x400")
+            self.archive_window.transient(self)
+
+            list_frame = ttk.Frame(self.archive_window, padding=(10, 10, 10, 0))
+            list_frame.pack(fill=tk.BOTH, expand=True)
+            self.archive_list = ttk.Treeview(list_frame, columns=("chat", "last_active", "messages"), show="headings")
+            self.archive_list.heading("chat", text="Chat")
+            self.archive_list.heading("last_active", text="Last Active")
+            self.archive_list.heading("messages", text="Messages")
+            self.archive_list.column("last_active", width=150, stretch=False)
+            self.archive_list.column("messages", width=80, stretch=False)
+            self.archive_list.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+            scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.archive_list.yview)
+            scrollbar.pack(fill=tk.Y, side=tk.RIGHT)
+            self.archive_list.config(yscrollcommand=scrollbar.set)
+            self.archive_list.bind("<Double-1>", self.restore_archived_chat)
+            self.archive_list.bind("<Return>", self.restore_archived_chat)
+
+            bottom = ttk.Frame(self.archive_window, padding="10")
+            bottom.pack(fill=tk.X)
+            ttk.Button(bottom, text="Restore and Open", command=self.restore_archived_chat).pack(side=tk.RIGHT)
+
+        self.archive_list.delete(*self.archive_list.get_children())
+        for session_id, name, model, last_active, archived_at, message_count in get_archived_sessions():
+            self.archive_list.insert("", "end", iid=str(session_id), values=(name, last_active or "", message_count))
+
+    def restore_archived_chat(self, event=None):
+        selection = self.archive_list.selection()
+        if not selection:
+            return
+        session_id = int(selection[0])
+        try:
+            restored = rehydrate_session(session_id)
+        except sqlite3.Error as e:
+            messagebox.showerror("Archived Chats", f"Could not restore chat: {e}", parent=self.archive_window)
+            return
+        self.archive_list.delete(selection[0])
+        if not restored:
+            return
+        self.load_sessions(set_selection=False)
+        item = self.find_tree_item_by_id(session_id)
+        if item:
+            self.session_tree.see(item)
+            self.session_tree.selection_set(item)
+            self.session_tree.focus(item)
+
     def export_chat(self):
         if not self.session_id:
             messagebox.showinfo("Export Chat", "No session selected to export.")
             return
 
-        messages = get_messages(self.session_id)
+        messages = [(role, content) for _id, _ordinal, role, content in get_messages(self.session_id)]
         
         # Get the current session's details
         current_session_info = None
@@ -1581,49 +1769,33 @@ class ChatApp(tk.Tk):
                 messagebox.showerror("Export Error", f"Failed to export chat: {e}")
 
     def import_chat(self):
-        file_path = filedialog.askopenfilename(
+        file_paths = filedialog.askopenfilenames(
             filetypes=[("JSON files", "*.json"), ("All files", "*.* ")]
         )
 
-        if file_path:
+        if len(file_paths) > 1:
+            self.import_chats_bulk(file_paths, parent_id=self.get_selected_folder_id())
+        elif file_paths:
+            file_path = file_paths[0]
             try:
-                with open(file_path, 'r') as f:
-                    imported_data = json.load(f)
-
-                imported_model = "gpt-3.5-turbo"
-                imported_messages = []
-                imported_system_prompt = ""
-
-                if isinstance(imported_data, dict) and "messages" in imported_data:
-                    imported_model = imported_data.get("model", "gpt-3.5-turbo")
-                    imported_messages = imported_data["messages"]
-                    imported_system_prompt = imported_data.get("system_prompt", "")
-                elif isinstance(imported_data, list):
-                    imported_messages = imported_data
-                else:
-                    raise ValueError("Invalid JSON format. Expected a list of messages or a dictionary with 'model' and 'messages'.")
+                imported = read_chat_export(file_path)
 
-                default_name = os.path.splitext(os.path.basename(file_path))[0]
                 new_session_name = tk.simpledialog.askstring(
                     "Import Chat",
                     "Enter a name for the new session:",
-                    initialvalue=default_name
+                    initialvalue=imported["name"]
                 )
                 
                 if not new_session_name:
                     return
 
-                parent_id = None
-                selection = self.session_tree.selection()
-                if selection:
-                    selected_item = selection[0]
-                    item_type = self.session_tree.item(selected_item, "values")[1]
-                    if item_type == 'folder':
-                        parent_id = self.session_tree.item(selected_item, "values")[0]
-
-                session_id = create_session(new_session_name, imported_model, imported_system_prompt, parent_id=parent_id)
-                for role, content in imported_messages:
-                    save_message(session_id, role, content)
+                session_id = import_session(
+                    new_session_name,
+                    imported["model"],
+                    imported["system_prompt"],
+                    imported["messages"],
+                    parent_id=self.get_selected_folder_id(),
+                )
 
                 self.load_sessions()
                 
@@ -1633,8 +1805,8 @@ class ChatApp(tk.Tk):
                     self.session_tree.focus(new_item)
                     self.select_session(None)
 
-                if imported_model in get_available_models():
-                    self.model_var.set(imported_model)
+                if imported["model"] in get_available_models():
+                    self.model_var.set(imported["model"])
                 else:
                     self.model_var.set("gpt-3.5-turbo")
 
@@ -1647,6 +1819,42 @@ class ChatApp(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Import Error", f"An unexpected error occurred: {e}")
 
+    def import_chat_folder(self, parent_id=None):
+        folder = filedialog.askdirectory(title="Import all chats in folder")
+        if folder:
+            self.import_chats_bulk([folder], parent_id=parent_id)
+
+    def import_chats_bulk(self, paths, parent_id=None):
+        """Import many exported chats (files or folders) under ``parent_id``."""
+        def on_progress(stats):
+            if stats["files"] % 50 == 0:
+                self.status_bar.config(text=f"Importing... {stats['sessions']} chats, {stats['messages']} messages")
+                self.update_idletasks()
+
+        try:
+            stats = import_chat_files(paths, parent_id=parent_id, progress=on_progress)
+        except Exception as e:
+            messagebox.showerror("Import Error", f"An unexpected error occurred: {e}")
+            return
+
+        self.load_sessions(set_selection=False)
+        summary = format_import_stats(stats)
+        print(summary)
+        if stats["errors"]:
+            failed = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in stats["errors"][:10])
+            messagebox.showwarning("Import Chats", f"{summary}\n\n{failed}")
+        else:
+            messagebox.showinfo("Import Chats", summary)
+
+    def get_selected_folder_id(self):
+        """Return the id of the selected folder, or None if a chat or nothing is selected."""
+        selection = self.session_tree.selection()
+        if selection:
+            selected_item = selection[0]
+            if self.session_tree.item(selected_item, "values")[1] == 'folder':
+                return int(self.session_tree.item(selected_item, "values")[0])
+        return None
+
     def export_system_prompts(self):
         prompts = get_system_prompts()
         if not prompts:
@@ -1787,6 +1995,7 @@ class ChatApp(tk.Tk):
                 else:
                     self.chat_files = []
                 self.update_files_listbox()
+                self.history_limit = HISTORY_PAGE_SIZE
                 self.load_chat_history()
                 self.message_history = get_input_history(self.session_id)
                 self.history_index = len(self.message_history)
@@ -1828,9 +2037,13 @@ class ChatApp(tk.Tk):
         else:
             self.input_box.configure(state="normal")
             self.send_button.configure(state="normal")
+            self.update_send_button()
             self.files_button.configure(state="normal" if self.rag_enabled else "disabled")
             self.status_bar.config(text="")
 
+    def update_send_button(self):
+        self.send_button.configure(text="Stop" if self.session_id in self.active_streams else "Send")
+
     def new_session(self, parent_id=None):
         name = f"Session {len(get_sessions()) + 1}"
         default_model = get_setting("default_model", "gpt-3.5-turbo")
@@ -1898,8 +2111,25 @@ class ChatApp(tk.Tk):
         if self.chat_history.tag_ranges("sel"):
             self.selection_context_menu.post(event.x_root, event.y_root)
         else:
+            self.context_message_id = self.message_id_at(f"@{event.x},{event.y}")
+            self.chat_history_menu.entryconfig("Delete Message", state="normal" if self.context_message_id else "disabled")
             self.chat_history_menu.post(event.x_root, event.y_root)
 
+    def message_id_at(self, index):
+        """Return the id of the message rendered at ``index`` in the chat history, if any."""
+        for tag in self.chat_history.tag_names(index):
+            if tag.startswith("message_") and tag[len("message_"):].isdigit():
+                return int(tag[len("message_"):])
+        return None
+
+    def delete_message_at_context(self):
+        message_id = getattr(self, "context_message_id", None)
+        if message_id is None:
+            return
+        if messagebox.askyesno("Delete Message", "Delete this message?"):
+            delete_messages([message_id])
+            self.load_chat_history(scroll_to_end=False)
+
     def process_selection(self, action):
         try:
             selected_text = self.chat_history.get(tk.SEL_FIRST, tk.SEL_LAST)
@@ -1941,7 +2171,7 @@ class ChatApp(tk.Tk):
             if action in prompt_map:
                 prompt_text = prompt_map[action]
                 full_prompt = f"{prompt_text}:\n\n---\n\n{selected_text}"
-                self.send_prompt_as_user(full_prompt)
+                self.send_prompt_as_user(full_prompt, cacheable=True)
             
         except tk.TclError:
             # This can happen if there is no selection
@@ -1949,108 +2179,95 @@ class ChatApp(tk.Tk):
         except Exception as e:
             messagebox.showerror("Error", f"An unexpected error occurred: {e}")
 
-    def send_prompt_as_user(self, prompt_content):
+    def send_prompt_as_user(self, prompt_content, cacheable=False):
         if not self.session_id:
             messagebox.showinfo("Action", "Please select a session first.")
             return
+        if self.session_id in self.active_streams:
+            self.show_status_message("Wait for the current reply to finish.")
+            return
 
         active_session_id = self.session_id
-        save_message(self.session_id, "user", prompt_content)
-        save_input_history(self.session_id, prompt_content)
-        self.message_history = get_input_history(self.session_id)
-        self.history_index = len(self.message_history)
-        
-        messages = get_messages(self.session_id)
-        message_blocks = [{"role": role, "content": content} for role, content in messages]
+        queue_message(self.session_id, "user", prompt_content)
+        self.remember_input(prompt_content)
         
         system_prompt = self.system_prompt_text.get("1.0", tk.END).strip()
-        if system_prompt:
-            message_blocks.insert(0, {"role": "system", "content": system_prompt})
         update_session_system_prompt(self.session_id, system_prompt)
         update_session_system_prompt_id(self.session_id, getattr(self, "current_system_prompt_id", None))
-
-        # RAG workflow: If chat has associated files, retrieve context from ChromaDB
-        context_block = None
-        if rag_functions and self.chat_files:
-            if not rag_functions['is_rag_loaded']():
-                self.show_status_message("RAG processing initializing...")
-                print("RAG processing initializing...")
-            try:
-                # Embed query and retrieve top-K relevant chunks
-                top_k = 5
-                rag_results = rag_functions['query_by_chat_id'](self.session_id, prompt_content, n_results=top_k)
-                if rag_results:
-                    context_texts = [r['text'] for r in rag_results]
-                    context_block = '\n---\n'.join(context_texts)
-                    # Prepend context to user message
-                    content_with_context = f"Context:\n{context_block}\n\nUser Query: {prompt_content}"
-                    # Replace user message in message_blocks
-                    for msg in message_blocks:
-                        if msg['role'] == 'user' and msg['content'] == prompt_content:
-                            msg['content'] = content_with_context
-                            break
-            except Exception as e:
-                self.show_status_message(f"RAG context retrieval failed: {e}")
-
-        self.load_chat_history()
-        self.update_idletasks()
-
-        try:
-            send_to_api(self.session_name, message_blocks, self.model_var.get(), active_session_id, self.chat_history)
-        except Exception as e:
-            messagebox.showerror("API Error", str(e))
+        message_blocks = self.build_message_blocks(prompt_content)
+
+        cache = self.get_response_cache() if cacheable else None
+        key = None
+        if cache:
+            # Keyed on the action and selection alone, not the session history:
+            # running an action adds it and its reply to the history, so a key
+            # over the full request would never match when it is repeated.
+            key = cache_key(self.model_var.get(), [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt_content},
+            ])
+            cached = cache.get(key)
+            if cached is not None:
+                queue_message(active_session_id, "assistant", cached)
+                self.load_chat_history()
+                self.show_status_message(f"Cached reply. {format_cache_stats(cache.stats())}")
+                return
 
         self.load_chat_history()
+        self.stream_reply(active_session_id, message_blocks, cache_key=key)
 
-        item_to_select = self.find_tree_item_by_id(active_session_id)
-        if item_to_select:
-            self.session_tree.selection_set(item_to_select)
-            self.session_tree.focus(item_to_select)
+    def get_response_cache(self):
+        """Return the reply cache for selection actions, or None if it is turned off."""
+        if not get_setting_bool("response_cache"):
+            return None
+        if self.response_cache is None:
+            self.response_cache = ResponseCache(
+                ttl_hours=get_setting_int("response_cache_ttl_hours", DEFAULT_TTL_HOURS),
+                max_mb=get_setting_int("response_cache_max_mb", DEFAULT_MAX_MB),
+            )
+        return self.response_cache
 
     def start_discussion_from_selection(self):
         try:
             selected_text = self.chat_history.get(tk.SEL_FIRST, tk.SEL_LAST)
-            if not selected_text:
-                return
+        except tk.TclError:
+            # This can happen if there is no selection
+            return
+        if not selected_text:
+            return
 
-            # Summarize the selected text to create a title for the new session
-            prompt = f"Summarize the following text in 5 words or less to use as a title for a new chat session:\n\n{selected_text}"
-            messages = [{"role": "user", "content": prompt}]
-            
-            # Call send_to_api without a widget to get the response directly
-            new_session_name = send_to_api(
-                "New Discussion", 
-                messages, 
-                "gpt-3.5-turbo", 
-                self.session_id, 
-                widget=None, 
-                save_message_to_db=False
-            ).strip().strip('"') # Strip quotes from the response
-
-            if not new_session_name:
-                new_session_name = "New Discussion"
+        # Summarize the selected text to create a title for the new session
+        prompt = f"Summarize the following text in 5 words or less to use as a title for a new chat session:\n\n{selected_text}"
+        messages = [{"role": "user", "content": prompt}]
+        model = self.model_var.get()
+        system_prompt = self.system_prompt_text.get("1.0", tk.END).strip()
+        system_prompt_id = getattr(self, "current_system_prompt_id", None)
+        self.show_status_message("Starting a new discussion...")
 
+        def create(reply):
+            new_session_name = reply.strip().strip('"') or "New Discussion" # Strip quotes from the response
             # Create a new session with the generated title
-            new_session_id = create_session(
-                new_session_name,
-                self.model_var.get(),
-                self.system_prompt_text.get("1.0", tk.END).strip(),
-                system_prompt_id=getattr(self, "current_system_prompt_id", None)
-            )
+            new_session_id = create_session(new_session_name, model, system_prompt, system_prompt_id=system_prompt_id)
             save_message(new_session_id, "user", f"Let's discuss the following:\n\n{selected_text}")
             self.load_sessions()
-            
+
             # Select the new session
             item_to_select = self.find_tree_item_by_id(new_session_id)
             if item_to_select:
                 self.session_tree.selection_set(item_to_select)
                 self.session_tree.focus(item_to_select)
 
-        except tk.TclError:
-            # This can happen if there is no selection
-            pass
-        except Exception as e:
-            messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+        # The title request can take a while with retries, so it runs in the background.
+        get_core().submit(
+            send_to_api,
+            "New Discussion",
+            messages,
+            "gpt-3.5-turbo",
+            self.session_id,
+            False,
+            on_done=self.bridge.wrap(create),
+            on_error=self.bridge.wrap(lambda e: messagebox.showerror("Error", f"An unexpected error occurred: {e}")),
+        )
 
     def copy_chat_selection(self):
         try:
@@ -2062,14 +2279,25 @@ class ChatApp(tk.Tk):
             # This can happen if there is no selection
             pass
 
-    def load_chat_history(self):
+    def load_chat_history(self, scroll_to_end=True):
         self.chat_history.configure(state="normal")
         self.chat_history.delete("1.0", tk.END)
         # Insert anchor at the start of chat
         self.chat_history.insert(tk.END, "", "start_anchor")
-        messages = get_messages(self.session_id)
-        for i, (role, content) in enumerate(messages):
-            anchor_name = f"msg_start_{i}"
+        # Only the newest page of a session is rendered; older messages are
+        # fetched a page at a time through the "Load earlier" link.
+        messages = get_messages(self.session_id, limit=self.history_limit)
+        if messages and has_earlier_messages(self.session_id, messages[0][1]):
+            self.chat_history.tag_config("load_earlier_link", foreground="blue", underline=True)
+            self.chat_history.insert(tk.END, "\nLoad earlier messages\n", ("load_earlier_link",))
+            self.chat_history.tag_bind("load_earlier_link", "<Button-1>", self.load_earlier_messages)
+            self.chat_history.tag_bind("load_earlier_link", "<Enter>", lambda e: self.chat_history.config(cursor="hand2"))
+            self.chat_history.tag_bind("load_earlier_link", "<Leave>", lambda e: self.chat_history.config(cursor=""))
+        for _id, _ordinal, role, content in messages:
+            # Messages still in the write-behind queue have no id yet.
+            key = _id if _id is not None else f"pending_{_ordinal}"
+            message_start = self.chat_history.index("end-1c")
+            anchor_name = f"msg_start_{key}"
             # Insert a newline with the anchor tag so it's a valid index
             self.chat_history.insert(tk.END, "\n", anchor_name)
             if role == 'user':
@@ -2078,77 +2306,159 @@ class ChatApp(tk.Tk):
                 self.chat_history.insert(tk.END, "\n\n")
             elif role == 'assistant':
                 self.chat_history.insert(tk.END, f"Assistant:\n", ("assistant_tag", "bold"))
-                
+
                 message_start_index = self.chat_history.index(tk.INSERT)
                 render_markdown_in_widget(self.chat_history, content)
-                message_end_index = self.chat_history.index(tk.INSERT)
+                self.add_assistant_links(key, anchor_name, message_start_index)
+            if _id is not None:
+                # Covers the whole message so any click inside it maps back to its id.
+                self.chat_history.tag_add(f"message_{_id}", message_start, "end-1c")
 
-                # Unique tags for each message body and its copy link
-                message_body_tag = f"assistant_message_body_{i}"
-                copy_link_tag = f"copy_link_for_{message_body_tag}"
-
-                self.chat_history.tag_add(message_body_tag, message_start_index, message_end_index)
-                
-                self.chat_history.insert(tk.END, "Copy", ("copy_link", copy_link_tag))
-                # Insert 'Start' link styled as hyperlink
-                self.chat_history.tag_config(f"start_link_{i}", foreground="blue", underline=True)
-                self.chat_history.insert(tk.END, " | Start", (f"start_link_{i}",))
-                self.chat_history.tag_bind(f"start_link_{i}", "<Button-1>", lambda e, idx=i: self.chat_history.see(f"msg_start_{idx}.first"))
-                self.chat_history.tag_bind(f"start_link_{i}", "<Enter>", lambda e: self.chat_history.config(cursor="hand2"))
-                self.chat_history.tag_bind(f"start_link_{i}", "<Leave>", lambda e: self.chat_history.config(cursor=""))
-                self.chat_history.insert(tk.END, "\n\n")
+        stream = self.active_streams.get(self.session_id)
+        if stream:
+            # The reply being streamed is not saved yet; show what has arrived.
+            self.begin_stream_render(stream)
+            stream.renderer.feed(stream.text)
 
         # Add a clickable 'start' link at the top
         self.chat_history.insert("1.0", "start", ("copy_link", "start_link"))
         self.chat_history.tag_bind("start_link", "<Button-1>", lambda e: self.chat_history.see("start_anchor.first"))
+        if scroll_to_end:
+            self.chat_history.see(tk.END)
+        self.chat_history.configure(state="disabled")
+
+    def add_assistant_links(self, key, anchor_name, body_start):
+        """Tag an assistant reply that ends the history and add its Copy and Start links."""
+        # Unique tags for each message body and its copy link
+        message_body_tag = f"message_body_{key}"
+        copy_link_tag = f"copy_link_for_{message_body_tag}"
+
+        self.chat_history.tag_add(message_body_tag, body_start, "end-1c")
+
+        self.chat_history.insert(tk.END, "Copy", ("copy_link", copy_link_tag))
+        # Insert 'Start' link styled as hyperlink
+        start_link_tag = f"start_link_{key}"
+        self.chat_history.tag_config(start_link_tag, foreground="blue", underline=True)
+        self.chat_history.insert(tk.END, " | Start", (start_link_tag,))
+        self.chat_history.tag_bind(start_link_tag, "<Button-1>", lambda e, anchor=anchor_name: self.chat_history.see(f"{anchor}.first"))
+        self.chat_history.tag_bind(start_link_tag, "<Enter>", lambda e: self.chat_history.config(cursor="hand2"))
+        self.chat_history.tag_bind(start_link_tag, "<Leave>", lambda e: self.chat_history.config(cursor=""))
+        self.chat_history.insert(tk.END, "\n\n")
+
+    def begin_stream_render(self, stream):
+        """Add the header for a streaming reply and start rendering its body after it."""
+        self.chat_history.insert(tk.END, "\n", f"msg_start_{stream.key}")
+        self.chat_history.insert(tk.END, "Assistant:\n", ("assistant_tag", "bold"))
+        stream.body_start = self.chat_history.index("end-1c")
+        stream.renderer = StreamingMarkdown(self.chat_history, f"stream_tail_{stream.key}")
+
+    def finish_stream_render(self, stream):
+        """Turn the rendered stream into a normal reply without re-rendering the history."""
+        self.chat_history.configure(state="normal")
+        self.add_assistant_links(stream.key, f"msg_start_{stream.key}", stream.body_start)
+        self.chat_history.mark_unset(stream.renderer.mark)
         self.chat_history.see(tk.END)
         self.chat_history.configure(state="disabled")
 
+    def load_earlier_messages(self, event=None):
+        self.history_limit += HISTORY_PAGE_SIZE
+        self.load_chat_history(scroll_to_end=False)
+        self.chat_history.see("1.0")
+
     def summarize_and_rename_session(self):
         if not self.session_id or not self.session_name:
             return
+        session_id, session_name = self.session_id, self.session_name
 
-        messages = get_messages(self.session_id)
-        if len(messages) < 2: # Need at least one user and one assistant message
-            return
+        def request_name():
+            # Runs on a request worker, so reading history never blocks the UI.
+            turns = self.session_turns(session_id, budget=RENAME_CONTEXT_TOKENS)
+            if len(turns) < 2: # Need at least one user and one assistant message
+                return None
 
-        conversation = ""
-        for role, content in messages:
-            conversation += f"{role.title()}: {content}\n"
+            conversation = ""
+            for turn in turns:
+                conversation += f"{turn['role'].title()}: {turn['content']}\n"
+            # A single long message can exceed the budget on its own; keep its end.
+            conversation = conversation[-RENAME_CONTEXT_TOKENS * 4:]
 
-        prompt = f"The current chat session name is '{self.session_name}'. Summarize the following conversation in 5 words or less. This summary will be used as the new session name. Only change the name if a significant topic shift occurs. Do not use quotes in the summary.\n\nConversation:\n{conversation}"
+            prompt = f"The current chat session name is '{session_name}'. Summarize the following conversation in 5 words or less. This summary will be used as the new session name. Only change the name if a significant topic shift occurs. Do not use quotes in the summary.\n\nConversation:\n{conversation}"
 
-        try:
             messages_for_summary = [
                 {"role": "system", "content": "You are a helpful assistant that summarizes chat sessions for use as a new session name."},
                 {"role": "user", "content": prompt}
             ]
-            
-            # Call send_to_api without a widget to get the response directly
-            new_name = send_to_api(
-                self.session_name, 
-                messages_for_summary, 
-                "gpt-3.5-turbo", 
-                self.session_id, 
-                widget=None,
-                save_message_to_db=False
-            ).strip().strip('"') # Strip quotes from the response
-
-            if new_name and new_name != self.session_name and len(new_name.split()) <= 5:
-                item_to_select = self.find_tree_item_by_id(self.session_id)
-                if not item_to_select:
-                    return 
-
-                update_session_name(self.session_id, new_name)
-                self.session_name = new_name
-                
-                # Update the name in the listbox directly
-                self.session_tree.item(item_to_select, text=new_name)
-                self.title(f"{APP_NAME} - {self.session_name}")
+            return send_to_api(session_name, messages_for_summary, "gpt-3.5-turbo", session_id, False)
 
+        def apply(reply):
+            if reply is not None:
+                self.apply_session_name(session_id, session_name, reply)
 
-        except Exception as e:
-            print(f"Error summarizing session: {e}")
+        # The naming request runs alongside any other requests so the UI stays responsive.
+        get_core().submit(
+            request_name,
+            on_done=self.bridge.wrap(apply),
+            on_error=lambda e: print(f"Error summarizing session: {e}"),
+        )
+
+    def update_session_summary(self, session_id, model):
+        """Fold the oldest unsummarized messages into the session's rolling summary.
+
+        Only happens once the unsummarized history presses on the model's
+        token budget. Each request folds in one batch of at most
+        summary_batch_tokens() and then checks again, so a long backlog is
+        summarized a batch at a time and every request fits the window.
+        History is read and the summary saved on a request worker.
+        """
+        if session_id in self.summarizing or not get_setting_bool("rolling_summaries", True):
+            return
+        budget = context_budget(model, get_setting_int("context_budget_tokens", 0))
+        self.summarizing.add(session_id)
+
+        def summarize():
+            summary = get_session_summary(session_id)
+            through_ordinal, previous, summary_tokens = summary if summary else (0, None, 0)
+            recent = self.session_turns(session_id, after=through_ordinal, budget=budget)
+            if not needs_summary(recent, summary_tokens, budget):
+                return None
+            # The newest turns are always sent verbatim, so never summarize them.
+            keep_from = recent[-SUMMARY_KEEP_RECENT]["ordinal"]
+            max_tokens = summary_batch_tokens(budget)
+            turns = turns_to_summarize(self.summary_candidates(session_id, through_ordinal, keep_from, max_tokens), max_tokens)
+            if not turns:
+                return None
+            reply = send_to_api(None, summary_request(previous, turns), model, session_id, False).strip()
+            if not reply:
+                return None
+            save_session_summary(session_id, turns[-1]["ordinal"], reply, count_tokens(reply))
+            return len(turns), count_tokens(reply)
+
+        def done(result):
+            self.summarizing.discard(session_id)
+            if result:
+                print(f"Summarized {result[0]} messages of session {session_id} into {result[1]} tokens")
+                # Fold in the next batch if the history still does not fit.
+                self.update_session_summary(session_id, model)
+
+        def failed(e):
+            self.summarizing.discard(session_id)
+            print(f"Error summarizing session history: {e}")
+
+        get_core().submit(summarize, on_done=self.bridge.wrap(done), on_error=self.bridge.wrap(failed))
+
+    def apply_session_name(self, session_id, old_name, reply):
+        new_name = reply.strip().strip('"') # Strip quotes from the response
+        if new_name and new_name != old_name and len(new_name.split()) <= 5:
+            item_to_select = self.find_tree_item_by_id(session_id)
+            if not item_to_select:
+                return
+
+            update_session_name(session_id, new_name)
+            # Update the name in the listbox directly
+            self.session_tree.item(item_to_select, text=new_name)
+            if self.session_id == session_id:
+                self.session_name = new_name
+                self.title(f"{APP_NAME} - {self.session_name}")
 
     def close_files_dialog(self):
         if hasattr(self, 'files_window') and self.files_window.winfo_exists():
@@ -2215,8 +2525,7 @@ class ChatApp(tk.Tk):
                     else:
                         if file_path.startswith("http://") or file_path.startswith("https://"):
                             rag_functions['delete_source_from_chat'](file_path, chat_id=self.session_id)
-                            delete_message_by_content(self.session_id, file_path)
-                            delete_message_by_content(self.session_id, f"Retrieved and stored content from {file_path}")
+                            delete_messages(get_message_ids_for_source(self.session_id, file_path))
                         else:
                             rag_functions['delete_file_from_chat'](file_path, chat_id=self.session_id)
                         self.show_status_message(f"File removed from ChromaDB for chat {self.session_id}.")
@@ -2290,6 +2599,9 @@ class ChatApp(tk.Tk):
             self.show_status_message(f"Failed to embed file: {e}")
 
     def send_message(self, event=None):
+        if self.session_id in self.active_streams:
+            self.show_status_message("Wait for the current reply to finish.")
+            return "break"
         content = self.input_box.get("1.0", tk.END).strip()
 
         self.input_box.delete("1.0", tk.END)
@@ -2303,14 +2615,12 @@ class ChatApp(tk.Tk):
             return "break"
 
         active_session_id = self.session_id
-        save_message(self.session_id, "user", content)
-        save_input_history(self.session_id, content)
-        self.message_history = get_input_history(self.session_id)
-        self.history_index = len(self.message_history)
-        self.current_input_buffer = ""
-
         url_pattern = r'^https?://\S+$'
-        if re.match(url_pattern, content) and rag_functions:
+        is_url = re.match(url_pattern, content) and rag_functions
+        queue_message(self.session_id, "user", content, source=content if is_url else None)
+        self.remember_input(content)
+
+        if is_url:
             self.load_chat_history()
             self.show_status_message(f"Retrieving {content}...")
             try:
@@ -2323,57 +2633,248 @@ class ChatApp(tk.Tk):
                 if content not in self.chat_files:
                     self.chat_files.append(content)
                     self.update_files_listbox()
-                save_message(self.session_id, "assistant", f"Retrieved and stored content from {content}")
+                queue_message(self.session_id, "assistant", f"Retrieved and stored content from {content}", source=content)
             except Exception as e:
-                save_message(self.session_id, "assistant", f"Error retrieving {content}: {e}")
+                queue_message(self.session_id, "assistant", f"Error retrieving {content}: {e}")
                 raise e
             self.load_chat_history()
             return "break"
         
-        messages = get_messages(self.session_id)
-        message_blocks = [{"role": role, "content": content} for role, content in messages]
-        
-        system_prompt = self.system_prompt_text.get("1.0", tk.END).strip()
-        if system_prompt:
-            message_blocks.insert(0, {"role": "system", "content": system_prompt})
+        message_blocks = self.build_message_blocks(content)
+
+        self.load_chat_history()
+        self.stream_reply(active_session_id, message_blocks, on_complete=self.summarize_and_rename_session)
+
+        return "break"
+
+    def session_turns(self, session_id, after=0, budget=None):
+        """Return a session's messages after ordinal ``after`` as turn dicts with token counts.
+
+        Messages are read newest first a page at a time. With ``budget``,
+        reading stops once the turns read cost more than that many tokens, so
+        a long history is not loaded and decompressed for every request.
+        Token counts are cached in the database, written in the background,
+        so history is only counted once.
+        """
+        counts = get_message_token_counts(session_id, after)
+        new_counts = {}
+        turns = []
+        used = 0
+        before = None
+        done = False
+        while not done:
+            rows = get_messages(session_id, before=before, limit=CONTEXT_PAGE_SIZE)
+            done = len(rows) < CONTEXT_PAGE_SIZE
+            for row in reversed(rows):
+                if row[1] <= after or (budget is not None and used > budget):
+                    done = True
+                    break
+                turn = self.message_turn(row, counts, new_counts)
+                turns.append(turn)
+                used += turn["tokens"] + MESSAGE_OVERHEAD_TOKENS
+            if rows:
+                before = rows[0][1]
+        if new_counts:
+            queue_token_counts(session_id, new_counts)
+        turns.reverse()
+        return turns
+
+    def summary_candidates(self, session_id, after, before, max_tokens):
+        """Return the oldest saved turns with ordinals between ``after`` and ``before``.
+
+        Read oldest first a page at a time, stopping once they cost more than
+        ``max_tokens``, so a long unsummarized backlog is taken a batch at a time.
+        """
+        counts = get_message_token_counts(session_id, after)
+        new_counts = {}
+        turns = []
+        used = 0
+        done = False
+        while not done:
+            rows = get_messages_after(session_id, after, CONTEXT_PAGE_SIZE)
+            done = len(rows) < CONTEXT_PAGE_SIZE
+            for row in rows:
+                if row[1] >= before or used > max_tokens:
+                    done = True
+                    break
+                turn = self.message_turn(row, counts, new_counts)
+                turns.append(turn)
+                used += turn["tokens"] + MESSAGE_OVERHEAD_TOKENS
+            if rows:
+                after = rows[-1][1]
+        if new_counts:
+            queue_token_counts(session_id, new_counts)
+        return turns
+
+    def message_turn(self, row, counts, new_counts):
+        """Return a get_messages() row as a turn dict, counting its tokens unless ``counts`` has them.
+
+        Newly counted messages are added to ``new_counts`` for caching.
+        """
+        _id, _ordinal, role, content = row
+        tokens = counts.get(_id)
+        if tokens is None:
+            tokens = count_tokens(content)
+            if _id is not None:
+                new_counts[_id] = tokens
+        return {"id": _id, "ordinal": _ordinal, "role": role, "content": content, "tokens": tokens}
+
+    def build_message_blocks(self, query):
+        """Assemble the messages to send for ``query``, the user message just queued.
+
+        Messages covered by the session's rolling summary are sent as that
+        summary, retrieved RAG context is added to the query, and older turns
+        are left out once the rest no longer fits the model's token budget.
+        """
+        budget = context_budget(self.model_var.get(), get_setting_int("context_budget_tokens", 0))
+        summary = get_session_summary(self.session_id)
+        if summary:
+            through_ordinal, summary_text, _tokens = summary
+        else:
+            through_ordinal, summary_text = 0, None
+        # Only as much history as can fit is read; assemble_context trims the rest.
+        turns = self.session_turns(self.session_id, after=through_ordinal, budget=budget)
 
         # RAG workflow: If chat has associated files, retrieve context from ChromaDB
-        context_block = None
         if rag_functions and self.chat_files:
             if not rag_functions['is_rag_loaded']():
                 self.show_status_message("RAG processing initializing...")
                 print("RAG processing initializing...")
             try:
+                # Embed query and retrieve top-K relevant chunks
                 top_k = 5
-                rag_results = rag_functions['query_by_chat_id'](self.session_id, content, n_results=top_k)
+                rag_results = rag_functions['query_by_chat_id'](self.session_id, query, n_results=top_k)
                 if rag_results:
                     context_texts = [r['text'] for r in rag_results]
                     context_block = '\n---\n'.join(context_texts)
-                    content_with_context = f"Context:\n{context_block}\n\nUser Query: {content}"
-                    for msg in message_blocks:
-                        if msg['role'] == 'user':
-                            msg['content'] = content_with_context
+                    # Prepend context to the query, the newest user message
+                    content_with_context = f"Context:\n{context_block}\n\nUser Query: {query}"
+                    for turn in reversed(turns):
+                        if turn['role'] == 'user':
+                            turn['content'] = content_with_context
+                            turn['tokens'] = count_tokens(content_with_context)
                             break
             except Exception as e:
                 self.show_status_message(f"RAG context retrieval failed: {e}")
 
-        self.load_chat_history()
-        
-        # Ensure the UI updates to show the user's message before the API call
-        self.update_idletasks()
+        system_prompt = self.system_prompt_text.get("1.0", tk.END).strip()
+        message_blocks, dropped = assemble_context(turns, budget, system_prompt, summary_text)
+        if dropped:
+            print(f"Context budget of {budget} tokens: left out the {dropped} oldest messages read")
+        return message_blocks
+
+    def stream_reply(self, session_id, message_blocks, on_complete=None, cache_key=None):
+        """Stream the assistant's reply in the background and render it as it arrives."""
+        stream = ChatStream(session_id, message_blocks, self.model_var.get())
+        stream.cache_key = cache_key
+        self.active_streams[session_id] = stream
+        if self.session_id == session_id:
+            self.chat_history.configure(state="normal")
+            self.begin_stream_render(stream)
+            self.chat_history.see(tk.END)
+            self.chat_history.configure(state="disabled")
+        stream.start()
+        self.update_send_button()
+        self.after(STREAM_FRAME_MS, self.drain_stream, stream, on_complete)
+
+    def on_send_button(self):
+        if self.session_id in self.active_streams:
+            self.stop_generation()
+        else:
+            self.send_message()
+
+    def stop_generation(self, event=None):
+        """Stop the reply streaming into the current chat, keeping what has arrived."""
+        stream = self.active_streams.get(self.session_id)
+        if stream:
+            stream.stopped = True
+            stream.cancel()
+            self.show_status_message("Stopping reply...")
+        return "break"
 
-        try:
-            send_to_api(self.session_name, message_blocks, self.model_var.get(), active_session_id, self.chat_history)
-        except Exception as e:
-            messagebox.showerror("API Error", str(e))
-        
-        # After the response, reload the history to show the assistant's message
-        self.load_chat_history()
-        
-        # Auto-summarize session name
-        self.summarize_and_rename_session()
+    def cancel_streams(self, session_ids):
+        """Stop any replies still streaming into the given sessions."""
+        for session_id in session_ids:
+            stream = self.active_streams.get(session_id)
+            if stream:
+                stream.cancel()
+
+    def drain_stream(self, stream, on_complete=None):
+        """Draw one frame: everything the stream worker posted since the last frame."""
+        finished, error, cancelled = False, None, False
+        chunks = []
+        while True:
+            try:
+                kind, value = stream.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "delta":
+                chunks.append(value)
+            elif kind == "retry":
+                print(value)
+                if self.session_id == stream.session_id:
+                    self.show_status_message(value)
+            else:
+                finished, error = True, value
+                cancelled = kind == "cancelled"
+                break
 
-        return "break"
+        if chunks:
+            started = time.perf_counter()
+            text = "".join(chunks)
+            stream.text += text
+            stream.deltas += len(chunks)
+            if self.session_id == stream.session_id:
+                self.chat_history.configure(state="normal")
+                stream.renderer.feed(text)
+                self.chat_history.see(tk.END)
+                self.chat_history.configure(state="disabled")
+                stream.frames += 1
+            stream.render_seconds += time.perf_counter() - started
+
+        if not finished:
+            self.after(STREAM_FRAME_MS, self.drain_stream, stream, on_complete)
+            return
+
+        if self.active_streams.get(stream.session_id) is stream:
+            del self.active_streams[stream.session_id]
+        elapsed = time.perf_counter() - stream.started
+        print(f"Streamed {stream.deltas} deltas in {elapsed:.1f}s, drawn in {stream.frames} frames "
+              f"({stream.render_seconds * 1000:.0f} ms on the UI thread)")
+        if cancelled and stream.stopped and stream.text:
+            # Keep the partial reply, marked so it is not mistaken for a complete one.
+            if self.session_id == stream.session_id:
+                self.chat_history.configure(state="normal")
+                stream.renderer.feed(TRUNCATED_MARKER)
+            stream.text += TRUNCATED_MARKER
+            queue_message(stream.session_id, "assistant", stream.text)
+            error, on_complete = None, None
+            self.show_status_message("Reply stopped.")
+        elif cancelled:
+            error = "Request cancelled."
+        elif error is not None:
+            messagebox.showerror("API Error", str(error))
+        else:
+            queue_message(stream.session_id, "assistant", stream.text)
+            if stream.cache_key and self.response_cache:
+                self.response_cache.put(stream.cache_key, stream.model, stream.text)
+            self.update_session_summary(stream.session_id, stream.model)
+        self.update_send_button()
+        if self.session_id == stream.session_id:
+            if error is None:
+                self.finish_stream_render(stream)
+                if on_complete:
+                    on_complete()
+            else:
+                # Drop the unsaved partial reply.
+                self.load_chat_history()
+
+    def remember_input(self, content):
+        """Record ``content`` in the input history, updating the in-memory list directly."""
+        queue_input_history(self.session_id, content)
+        self.message_history = (self.message_history + [content])[-INPUT_HISTORY_LIMIT:]
+        self.history_index = len(self.message_history)
+        self.current_input_buffer = ""
 
     def history_up_wrapper(self, event):
         # Only trigger history if cursor is at the beginning of the input box
@@ -2492,6 +2993,105 @@ class ChatApp(tk.Tk):
             self.chat_history.tag_add("current_match", start_pos, end_pos)
             self.chat_history.see(start_pos)
 
+    def open_search_all_dialog(self, event=None, query=""):
+        """Open a window that searches messages across every session."""
+        if hasattr(self, 'search_all_window') and self.search_all_window.winfo_exists():
+            self.search_all_window.lift()
+        else:
+            self.search_all_window = tk.Toplevel(self)
+            self.search_all_window.title("Search All Chats")
+            self.search_all_window.geometry("700x400")
+            self.search_all_window.transient(self)
+
+            top = ttk.Frame(self.search_all_window, padding="10")
+            top.pack(fill=tk.X)
+            self.search_all_entry = ttk.Entry(top)
+            self.search_all_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+            self.search_all_entry.bind("<Return>", self.run_search_all)
+            self.search_all_entry.bind("<Escape>", lambda e: self.search_all_window.destroy())
+            ttk.Button(top, text="Search", command=self.run_search_all).pack(side=tk.LEFT, padx=(5, 0))
+
+            results_frame = ttk.Frame(self.search_all_window, padding=(10, 0, 10, 0))
+            results_frame.pack(fill=tk.BOTH, expand=True)
+            self.search_all_results = ttk.Treeview(results_frame, columns=("chat", "role", "snippet"), show="headings")
+            self.search_all_results.heading("chat", text="Chat")
+            self.search_all_results.heading("role", text="Role")
+            self.search_all_results.heading("snippet", text="Match")
+            self.search_all_results.column("chat", width=150, stretch=False)
+            self.search_all_results.column("role", width=80, stretch=False)
+            self.search_all_results.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+            scrollbar = ttk.Scrollbar(results_frame, orient=tk.VERTICAL, command=self.search_all_results.yview)
+            scrollbar.pack(fill=tk.Y, side=tk.RIGHT)
+            self.search_all_results.config(yscrollcommand=scrollbar.set)
+            self.search_all_results.bind("<Double-1>", self.open_search_all_result)
+            self.search_all_results.bind("<Return>", self.open_search_all_result)
+
+            self.search_all_status = ttk.Label(self.search_all_window, text="", anchor=tk.W, padding=(10, 5))
+            self.search_all_status.pack(fill=tk.X)
+            self.search_all_hits = {}
+
+        if query:
+            self.search_all_entry.delete(0, tk.END)
+            self.search_all_entry.insert(0, query)
+            self.run_search_all()
+        self.search_all_entry.focus_set()
+
+    def run_search_all(self, event=None):
+        query = self.search_all_entry.get().strip()
+        self.search_all_results.delete(*self.search_all_results.get_children())
+        self.search_all_hits = {}
+        if not query:
+            self.search_all_status.config(text="")
+            return
+        started = time.perf_counter()
+        try:
+            hits = search_messages(query)
+        except sqlite3.Error as e:
+            self.search_all_status.config(text=f"Search failed: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        for message_id, session_id, session_name, ordinal, role, snippet in hits:
+            item = self.search_all_results.insert("", "end", values=(session_name, role, " ".join(snippet.split())))
+            self.search_all_hits[item] = (session_id, message_id, ordinal)
+        self.search_all_status.config(text=f"{len(hits)} matches in {elapsed_ms:.1f} ms")
+
+    def open_search_all_result(self, event=None):
+        selection = self.search_all_results.selection()
+        if not selection or selection[0] not in self.search_all_hits:
+            return
+        session_id, message_id, ordinal = self.search_all_hits[selection[0]]
+        self.jump_to_message(session_id, message_id, ordinal)
+
+    def jump_to_message(self, session_id, message_id, ordinal):
+        """Select ``session_id`` in the tree and scroll its history to a message."""
+        item = self.find_tree_item_by_id(session_id)
+        if not item:
+            self.show_status_message("That chat is no longer available.")
+            return
+        self.session_tree.see(item)
+        if self.session_id != session_id:
+            self.session_tree.selection_set(item)
+            self.session_tree.focus(item)
+        # Selecting the item reloads the history from <<TreeviewSelect>>, so
+        # scroll once that event has been handled.
+        self.after_idle(lambda: self.show_message(session_id, message_id, ordinal))
+
+    def show_message(self, session_id, message_id, ordinal):
+        if self.session_id != session_id:
+            return
+        needed = count_messages_from(session_id, ordinal)
+        if needed > self.history_limit:
+            self.history_limit = needed
+            self.load_chat_history(scroll_to_end=False)
+        ranges = self.chat_history.tag_ranges(f"message_{message_id}")
+        if not ranges:
+            return
+        start = ranges[0]
+        self.chat_history.tag_remove("current_match", "1.0", tk.END)
+        self.chat_history.tag_config("current_match", background="orange", foreground="black")
+        self.chat_history.tag_add("current_match", f"{start}+1l linestart", f"{start}+1l lineend")
+        self.chat_history.see(start)
+
 def main():
     global DB_PATH, RECENT_DBS, WINDOW_GEOMETRIES
     parser = argparse.ArgumentParser(description="SlipstreamAI Chat Client")
@@ -2510,6 +3110,7 @@ def main():
     save_recent_dbs(RECENT_DBS)
     print(f"Using database: {DB_PATH}")
     WINDOW_GEOMETRIES = load_window_geometries()
+    set_db_path(DB_PATH)
     # Initialize database first so settings are available
     init_db()
     # Now initialize RAG based on settings
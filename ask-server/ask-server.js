@@ -13,6 +13,8 @@ const OPENAI_API_KEY = process.env.OPENAI_API_KEY
 const API_SECRET_TOKEN = process.env.API_SECRET_TOKEN
 const SSL_KEY_PATH = process.env.SSL_KEY_PATH
 const SSL_CERT_PATH = process.env.SSL_CERT_PATH
+// How long the OpenAI model list is reused before /mods asks OpenAI again
+const MODELS_CACHE_TTL_MS = Number(process.env.MODELS_CACHE_TTL_MS || 10 * 60 * 1000)
 
 if (!OPENAI_API_KEY || !API_SECRET_TOKEN) {
   console.error('❌ Missing OPENAI_API_KEY or API_SECRET_TOKEN in .env')
@@ -31,8 +33,14 @@ app.use((req, res, next) => {
   next()
 })
 
+let modelsCache = null
+
 app.get('/mods', async (req, res) => {
   try {
+    // Express answers If-None-Match with a 304 when the cached list is unchanged
+    if (modelsCache && Date.now() - modelsCache.fetchedAt < MODELS_CACHE_TTL_MS) {
+      return res.json(modelsCache.data)
+    }
     console.log("Incoming request body:", req.body);
     const openaiRes = await fetch('https://api.openai.com/v1/models', {
       method: 'GET',
@@ -48,6 +56,7 @@ app.get('/mods', async (req, res) => {
     }
 
     const data = await openaiRes.json()
+    modelsCache = { data, fetchedAt: Date.now() }
     res.json(data)
   } catch (err) {
     console.error('❌ Proxy error fetching models:', err)
@@ -1,14 +1,21 @@
 import os
 import sys
 import argparse
+import json
 import re
-import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import http_pool
+from sse import iter_stream_deltas
 from dotenv import load_dotenv
 
 load_dotenv()
 
 PROXY_URL = os.getenv("OPENAI_PROXY_URL", "http://localhost:3000/chat")
 API_SECRET = os.getenv("API_SECRET_TOKEN", "my-secret-token")
+HEADERS = {
+    "Content-Type": "application/json",
+    "x-api-secret": API_SECRET
+}
 
 def parse_input(raw_text: str):
     prompt_match = re.search(r'(?i)^prompt:\s*(.*)', raw_text, re.MULTILINE)
@@ -24,64 +31,169 @@ def parse_input(raw_text: str):
 
     return full_prompt, prompt, ai_input, model_override, system
 
+def make_payload(prompt, ai_input, model, system=None, stream=False):
+    payload = {
+        "model": model,
+        "prompt": prompt if prompt else None,
+        "ai": ai_input,
+        "stream": stream
+    }
+    if system:
+        payload["system"] = system
+    return payload
+
+def build_payload(raw_text, default_model, stream=False):
+    full_prompt, prompt, ai_input, model_override, system = parse_input(raw_text)
+    return make_payload(prompt, ai_input, model_override or default_model, system, stream)
+
+def ask(payload, on_delta=None):
+    """Send one payload to the proxy and return the reply text.
+
+    Streamed replies are decoded as JSON server-sent events; ``on_delta`` is
+    called with each piece of text as it arrives.
+    """
+    if payload["stream"]:
+        chunks = []
+        with http_pool.post_with_retry(PROXY_URL, json=payload, headers=HEADERS, stream=True) as resp:
+            resp.raise_for_status()
+            for content in iter_stream_deltas(resp):
+                chunks.append(content)
+                if on_delta:
+                    on_delta(content)
+        return "".join(chunks)
+    resp = http_pool.post_with_retry(PROXY_URL, json=payload, headers=HEADERS)
+    resp.raise_for_status()
+    data = resp.json()
+    return data['choices'][0]['message']['content'].strip()
+
+def batch_payload(line, default_model, stream=False):
+    """Build the payload for one JSONL input line and return it with the line's id.
+
+    A line is either a JSON string in the ``prompt:``/``ai:`` form parse_input
+    reads, or an object with ``prompt``, ``ai``, ``model`` and ``system``
+    fields (or a ``text`` field in the string form). Object fields are used
+    as they are, so their values may span lines or contain ``model:`` text.
+    An object with only a ``prompt`` sends it as the input.
+    """
+    item = json.loads(line)
+    if isinstance(item, str):
+        return build_payload(item, default_model, stream), None
+    if not isinstance(item, dict):
+        raise ValueError("expected a JSON string or object")
+    if "text" in item:
+        return build_payload(item["text"], default_model, stream), item.get("id")
+    fields = {key: item.get(key) for key in ("prompt", "ai", "model", "system")}
+    for key, value in fields.items():
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"'{key}' must be a string")
+    prompt, ai_input = fields["prompt"], fields["ai"]
+    if not ai_input:
+        if not prompt:
+            raise ValueError("expected a 'prompt', 'ai' or 'text' field")
+        prompt, ai_input = None, prompt
+    payload = make_payload(prompt, ai_input, fields["model"] or default_model, fields["system"], stream)
+    return payload, item.get("id")
+
+def run_batch_item(line_number, line, args):
+    result = {"line": line_number}
+    try:
+        payload, item_id = batch_payload(line, args.model, args.stream)
+        if item_id is not None:
+            result["id"] = item_id
+        result["model"] = payload["model"]
+        result["response"] = ask(payload)
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+def run_batch(args):
+    """Answer every prompt in a JSONL file (or stdin), writing one JSON result per line.
+
+    Up to ``--workers`` prompts are in flight at once and only a bounded
+    number of lines are read ahead, so arbitrarily large inputs run in
+    constant memory. Results come out in input order unless ``--unordered``.
+    Returns the number of prompts that failed.
+    """
+    source = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    lines = ((number, line) for number, line in enumerate(source, 1) if line.strip())
+    max_pending = args.workers * 4
+    pending = {}
+    finished = {}
+    next_seq = 0
+    failures = 0
+
+    def emit(result):
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            for seq, (number, line) in enumerate(lines):
+                pending[pool.submit(run_batch_item, number, line, args)] = seq
+                # Results held back for ordering count against the read-ahead too.
+                if len(pending) + len(finished) >= max_pending:
+                    next_seq, failures = _collect(pending, finished, next_seq, failures, emit, args.unordered)
+            while pending:
+                next_seq, failures = _collect(pending, finished, next_seq, failures, emit, args.unordered)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    return failures
+
+def _collect(pending, finished, next_seq, failures, emit, unordered):
+    """Wait for at least one prompt to finish and write out whatever results are due."""
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        seq = pending.pop(future)
+        result = future.result()
+        failures += "error" in result
+        if unordered:
+            emit(result)
+        else:
+            finished[seq] = result
+    while next_seq in finished:
+        emit(finished.pop(next_seq))
+        next_seq += 1
+    return next_seq, failures
+
 def main():
     parser = argparse.ArgumentParser(description="Send prompt+input to OpenAI via proxy.")
     parser.add_argument("text", type=str, nargs="*", help="Combined prompt and AI input")
     parser.add_argument("--model", type=str, default="gpt-3.5-turbo", help="Default OpenAI model to use")
     parser.add_argument("--stream", action="store_true", help="Stream output live")
+    parser.add_argument("--batch", type=str, metavar="FILE", help="Answer JSONL prompts from FILE ('-' for stdin), one JSON result per line")
+    parser.add_argument("--workers", type=int, default=http_pool.POOL_SIZE, help="Prompts in flight at once in batch mode")
+    parser.add_argument("--unordered", action="store_true", help="In batch mode, write results as they finish instead of in input order")
+    parser.add_argument("--output", type=str, metavar="FILE", help="In batch mode, write results to FILE instead of stdout")
     args = parser.parse_args()
 
+    if args.batch:
+        failures = run_batch(args)
+        if failures:
+            print(f"❌ {failures} prompt(s) failed", file=sys.stderr)
+            sys.exit(1)
+        return
+
     if not args.text:
         print("❌ Error: No input text provided.")
         sys.exit(1)
 
-    raw_text = "\n".join(args.text)
-    full_prompt, prompt, ai_input, model_override, system = parse_input(raw_text)
-    selected_model = model_override or args.model
-
-    payload = {
-        "model": selected_model,
-        "prompt": prompt if prompt else None,
-        "ai": ai_input,
-        "stream": args.stream
-    }
-
-    if system:
-        payload["system"] = system
+    payload = build_payload("\n".join(args.text), args.model, args.stream)
 
     #print("Sending payload to proxy:")
     #print(payload)
     try:
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-secret": API_SECRET
-        }
-
         if args.stream:
-            with requests.post(PROXY_URL, json=payload, headers=headers, stream=True) as resp:
-                resp.raise_for_status()
-                for line in resp.iter_lines(decode_unicode=True):
-                    if line.startswith("data: "):
-                        chunk = line[6:]
-                        if chunk.strip() == "[DONE]":
-                            break
-                        try:
-                            delta = eval(chunk) if chunk.startswith("{") else {}
-                            content = delta.get("choices", [{}])[0].get("delta", {}).get("content")
-                            if content:
-                                print(content, end="", flush=True)
-                        except Exception:
-                            pass
-                print()
+            ask(payload, on_delta=lambda content: print(content, end="", flush=True))
+            print()
         else:
-            resp = requests.post(PROXY_URL, json=payload, headers=headers)
-            resp.raise_for_status()
-            data = resp.json()
-            print(data['choices'][0]['message']['content'].strip())
+            print(ask(payload))
 
     except Exception as e:
         print(f"❌ Proxy/API Error: {e}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
-
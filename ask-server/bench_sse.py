@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Measure how fast streamed chat completions are decoded, in tokens per second.
+
+Decoder-only runs feed a prebuilt SSE body to each decoder in chunks of
+several sizes, comparing the line-based parsing the client used before
+sse.py with the incremental decoder on the json and orjson backends. The
+end-to-end run streams from an in-process mock_server as fast as it can
+send, through the shared HTTP session.
+
+    python bench_sse.py --tokens 50000
+"""
+import argparse
+import json
+import time
+
+import sse
+from mock_server import MockServer, reply_tokens
+
+CHUNK_SIZES = [7, 64, 1460, 16384]
+
+
+def build_stream(tokens):
+    """Return an SSE body carrying ``tokens`` one per event, as OpenAI streams them."""
+    events = []
+    for token in tokens:
+        chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                 "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+        events.append(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+    events.append(b"data: [DONE]\n\n")
+    return b"".join(events)
+
+
+def split(body, size):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+def line_based_deltas(chunks):
+    """The parsing the client did before sse.py: requests' iter_lines, decode, slice, json.loads."""
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        pending = lines.pop() if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1] else None
+        for line in lines:
+            if line:
+                decoded_line = line.decode('utf-8')
+                if decoded_line.startswith("data: "):
+                    json_data = decoded_line[len("data: "):]
+                    if json_data == "[DONE]":
+                        return
+                    data = json.loads(json_data)
+                    if 'choices' in data and len(data['choices']) > 0:
+                        delta = data['choices'][0]['delta']
+                        if 'content' in delta:
+                            yield delta['content']
+
+
+def count_rate(tokens, seconds):
+    return f"{tokens / seconds:14,.0f} tokens/s"
+
+
+def time_decoder(name, decode, chunks, expected, token_count, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        text = "".join(decode(chunks))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    status = "" if text == expected else "  (OUTPUT MISMATCH)"
+    return f"{name:<24}{best * 1000:9.1f} ms{count_rate(token_count, best)}{status}"
+
+
+def bench_decoders(token_count, repeat):
+    tokens = reply_tokens(token_count)
+    expected = "".join(tokens)
+    body = build_stream(tokens)
+    backends = [("json", sse._json_loads)]
+    if sse.orjson is not None:
+        backends.append(("orjson", sse.orjson.loads))
+    print(f"Decoding {token_count:,} tokens ({len(body) / 1e6:.1f} MB of SSE), best of {repeat}")
+    for size in CHUNK_SIZES:
+        chunks = split(body, size)
+        print(f"\n{size}-byte chunks")
+        print(time_decoder("line-based (old)", line_based_deltas, chunks, expected, token_count, repeat))
+        for name, loads in backends:
+            sse.loads = loads
+            print(time_decoder(f"incremental + {name}", sse.iter_delta_content, chunks, expected, token_count, repeat))
+    sse.loads = backends[-1][1]
+
+
+def line_based_stream_deltas(resp):
+    """The client's streaming loop before sse.py, reading through requests' iter_lines()."""
+    for line in resp.iter_lines():
+        if line:
+            decoded_line = line.decode('utf-8')
+            if decoded_line.startswith("data: "):
+                json_data = decoded_line[len("data: "):]
+                if json_data == "[DONE]":
+                    break
+                data = json.loads(json_data)
+                if 'choices' in data and len(data['choices']) > 0:
+                    delta = data['choices'][0]['delta']
+                    if 'content' in delta:
+                        yield delta['content']
+
+
+def bench_end_to_end(token_count, chunk_tokens, repeat):
+    import http_pool
+
+    server = MockServer(reply_tokens=token_count, chunk_tokens=chunk_tokens).start()
+    expected = "".join(reply_tokens(token_count))
+    payload = {"model": "bench", "messages": [{"role": "user", "content": "bench"}], "stream": True}
+    print(f"\nEnd to end from mock_server, {chunk_tokens} token(s) per event")
+    try:
+        for name, decode in (("iter_lines (old)", line_based_stream_deltas), ("sse.iter_stream_deltas", sse.iter_stream_deltas)):
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with http_pool.post(server.url + "/v1/chat/completions", json=payload, stream=True) as resp:
+                    resp.raise_for_status()
+                    text = "".join(decode(resp))
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            status = "" if text == expected else "  (OUTPUT MISMATCH)"
+            print(f"{name:<24}{best * 1000:9.1f} ms{count_rate(token_count, best)}{status}")
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSE decoding of streamed completions.")
+    parser.add_argument("--tokens", type=int, default=20000, help="Tokens in the benchmark stream")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per decoder; the best is reported")
+    args = parser.parse_args()
+    bench_decoders(args.tokens, args.repeat)
+    bench_end_to_end(args.tokens, 1, args.repeat)
+    bench_end_to_end(args.tokens, 8, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
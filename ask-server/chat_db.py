@@ -0,0 +1,1133 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Default database path. ask-client.py overrides it via set_db_path() once the
+# --db argument and the recent database list have been resolved.
+DB_PATH = "chat_sessions.db"
+
+# Each thread gets its own long-lived connection. sqlite3 connections are not
+# safe to share across threads without extra locking, and one connection per
+# thread lets WAL readers run while another thread is writing.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+# Bumped by close_db() so threads drop connections that were closed under them.
+_generation = 0
+
+# Contents of the settings table, loaded once by init_db() and kept current by
+# save_setting(). Settings are read constantly by the UI and written rarely.
+_settings = None
+
+# Number of entries get_input_history() returns by default.
+INPUT_HISTORY_LIMIT = 25
+
+# Set by init_db() once the FTS5 message index is known to exist.
+FTS_ENABLED = False
+
+# Optional compressed storage for message bodies, toggled by the
+# "compress_messages" setting. Bodies of at least COMPRESS_MIN_SIZE characters
+# are moved to message_bodies, compressed and shared between identical
+# messages; shorter ones stay inline in messages.content.
+COMPRESS_BODIES = False
+COMPRESS_MIN_SIZE = 1024
+
+# Number of prepared statements sqlite3 keeps per connection. The default of
+# 128 is plenty today but the helpers below issue a fixed set of statements, so
+# keeping them all compiled avoids re-parsing SQL on every call.
+STATEMENT_CACHE_SIZE = 256
+
+
+def _connect(path):
+    """Open a connection tuned for the chat client's access pattern."""
+    # IMMEDIATE takes the write lock when a transaction starts, so the
+    # background writer and the UI thread queue on busy_timeout instead of
+    # failing when one of them upgrades a stale read snapshot to a write.
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                           isolation_level="IMMEDIATE",
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    # WAL lets readers and a writer proceed concurrently and turns each commit
+    # into an append to the log instead of a rewrite of the main file.
+    conn.execute("PRAGMA journal_mode=WAL")
+    # In WAL mode NORMAL only fsyncs at checkpoints, which is still durable
+    # against application crashes and avoids an fsync per commit.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    # Used by queries, the FTS view and its triggers to read compressed bodies.
+    conn.create_function("decode_body", 2, _decode_body, deterministic=True)
+    return conn
+
+
+def _encode_body(text):
+    """Compress ``text`` with zstd when available, otherwise zlib."""
+    raw = text.encode("utf-8")
+    if zstandard is not None:
+        codec, data = "zstd", zstandard.ZstdCompressor(level=9).compress(raw)
+    else:
+        codec, data = "zlib", zlib.compress(raw, 9)
+    if len(data) >= len(raw):
+        return "plain", raw
+    return codec, data
+
+
+def _decode_body(codec, data, strict=False):
+    """Expand a stored body.
+
+    Without the zstandard package a zstd body cannot be read. For display a
+    placeholder is returned instead; ``strict`` raises sqlite3.DataError,
+    and every path that rewrites or moves a body must use it so the
+    placeholder is never stored in place of the real text.
+    """
+    if data is None:
+        return None
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    if codec == "zstd":
+        if zstandard is None:
+            if strict:
+                raise sqlite3.DataError("Message compressed with zstd; install the zstandard package to move it.")
+            return "[message compressed with zstd; install the zstandard package to read it]"
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return bytes(data).decode("utf-8")
+
+
+def set_db_path(path):
+    """Point the data-access layer at ``path``, closing any open connections."""
+    global DB_PATH
+    if path != DB_PATH:
+        flush_writes()
+        close_db()
+    DB_PATH = path
+
+
+def get_connection():
+    """Return the calling thread's connection to ``DB_PATH``, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect(DB_PATH)
+        _local.conn = conn
+        _local.generation = _generation
+        _local.depth = 0
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_db():
+    """Close every connection opened by this module, from any thread.
+
+    Call flush_writes() first if queued writes must not be lost.
+    """
+    global _generation, _settings
+    _settings = None
+    with _connections_lock:
+        _generation += 1
+        conns = list(_connections)
+        _connections.clear()
+    for conn in conns:
+        try:
+            conn.commit()
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+@contextmanager
+def transaction():
+    """Run a group of writes as a single transaction with one commit.
+
+    Nested ``transaction()`` blocks join the outermost one, so helpers can be
+    combined into larger units of work without committing part way through.
+    """
+    conn = get_connection()
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.rollback()
+        raise
+    else:
+        _local.depth -= 1
+        if _local.depth == 0:
+            conn.commit()
+
+
+class WriteBehindQueue:
+    """Commit message and input-history inserts and token counts from a background thread.
+
+    Inserts are queued and return immediately. The writer thread drains
+    whatever has accumulated and commits it as one transaction. Until a batch
+    is committed its rows stay in ``pending`` so readers can overlay them on
+    what is already in the database.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self._pending = []
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def put(self, kind, *args):
+        with self.lock:
+            self._pending.append((kind, args))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((kind, args))
+
+    def pending(self, kind, session_id):
+        """Return queued argument tuples of ``kind`` for a session. Call with ``lock`` held."""
+        return [args for k, args in self._pending if k == kind and args[0] == session_id]
+
+    def flush(self):
+        """Block until everything queued so far has been committed."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        conn = get_connection()
+        try:
+            for kind, args in batch:
+                _QUEUED_WRITERS[kind](conn, *args)
+            # Readers take the lock to see the database and the pending list
+            # together, so commit and dequeue as one step.
+            with self.lock:
+                conn.commit()
+                del self._pending[:len(batch)]
+            return
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Batched write failed, retrying individually: {e}")
+        for kind, args in batch:
+            try:
+                _QUEUED_WRITERS[kind](conn, *args)
+                with self.lock:
+                    conn.commit()
+                    self._pending.pop(0)
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"Dropping queued {kind} for session {args[0]}: {e}")
+                with self.lock:
+                    self._pending.pop(0)
+
+_write_queue = WriteBehindQueue()
+
+def queue_message(session_id, role, content, source=None):
+    """Save a message in the background; it is visible to get_messages() at once."""
+    _write_queue.put("message", session_id, role, content, source)
+
+def queue_input_history(session_id, content):
+    """Save an input history entry in the background."""
+    _write_queue.put("input_history", session_id, content)
+
+def flush_writes():
+    """Wait for queued writes to reach the database."""
+    # Inside an open transaction this thread may already hold the write lock
+    # the writer needs, so waiting here would stall both until busy_timeout.
+    if getattr(_local, "depth", 0):
+        return
+    _write_queue.flush()
+
+# --- Schema migrations ---
+#
+# The schema is built by an ordered list of migrations. Each one runs in its
+# own transaction and is recorded in schema_version, so an existing database
+# only runs the steps it has not seen yet. Databases created before
+# schema_version existed start from version 0, which is why every migration
+# checks the current layout before changing it.
+
+_MESSAGES_TABLE = '''CREATE TABLE {name} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id INTEGER,
+                    ordinal INTEGER NOT NULL,
+                    role TEXT,
+                    content TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    body_id INTEGER,
+                    source TEXT,
+                    tokens INTEGER,
+                    FOREIGN KEY(session_id) REFERENCES sessions(id),
+                    FOREIGN KEY(body_id) REFERENCES message_bodies(id)
+                )'''
+
+def _table_columns(c, table):
+    return [row[1] for row in c.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _migrate_base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS system_prompts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    title TEXT NOT NULL UNIQUE,
+                    prompt TEXT NOT NULL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    model TEXT DEFAULT 'gpt-3.5-turbo',
+                    system_prompt TEXT,
+                    system_prompt_id INTEGER,
+                    parent_id INTEGER,
+                    type TEXT DEFAULT 'chat',
+                    FOREIGN KEY(parent_id) REFERENCES sessions(id)
+                )''')
+    if 'system_prompt_id' not in _table_columns(c, 'sessions'):
+        c.execute('ALTER TABLE sessions ADD COLUMN system_prompt_id INTEGER')
+    c.execute('''CREATE TABLE IF NOT EXISTS input_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id INTEGER,
+                    content TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(session_id) REFERENCES sessions(id)
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )''')
+    c.execute("INSERT OR IGNORE INTO settings (key, value) VALUES ('enable_rag', 'true')")
+
+def _migrate_keyed_messages(c):
+    """Give messages an id, a per-session ordinal and a timestamp.
+
+    Older databases stored messages without a primary key and relied on rowid
+    order. The table is rebuilt with each session's messages numbered in that
+    order so existing conversations keep their sequence.
+    """
+    cols = _table_columns(c, 'messages')
+    if not cols:
+        c.execute(_MESSAGES_TABLE.format(name="messages"))
+    elif 'ordinal' not in cols:
+        print("Migrating messages table to keyed layout...")
+        # Left behind by a rebuild that was interrupted before migrations ran atomically.
+        c.execute("DROP TABLE IF EXISTS messages_new")
+        c.execute(_MESSAGES_TABLE.format(name="messages_new"))
+        c.execute('''INSERT INTO messages_new (session_id, ordinal, role, content, created_at)
+                     SELECT session_id,
+                            ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY rowid),
+                            role, content, NULL
+                     FROM messages ORDER BY rowid''')
+        c.execute("DROP TABLE messages")
+        c.execute("ALTER TABLE messages_new RENAME TO messages")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_session_ordinal ON messages(session_id, ordinal)")
+
+def _migrate_message_bodies(c):
+    """Add shared, optionally compressed storage for large message bodies."""
+    if 'body_id' not in _table_columns(c, 'messages'):
+        c.execute('ALTER TABLE messages ADD COLUMN body_id INTEGER REFERENCES message_bodies(id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS message_bodies (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    hash TEXT NOT NULL UNIQUE,
+                    codec TEXT NOT NULL,
+                    data BLOB NOT NULL
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_body ON messages(body_id) WHERE body_id IS NOT NULL")
+    # Message text with compressed bodies expanded; the FTS index reads it.
+    # It calls decode_body(), so only connections opened here can query it.
+    c.execute('''CREATE VIEW IF NOT EXISTS message_text AS
+                 SELECT m.id AS id, COALESCE(m.content, decode_body(b.codec, b.data)) AS content
+                 FROM messages m LEFT JOIN message_bodies b ON b.id = m.body_id''')
+
+def _migrate_fts(c):
+    """Create the FTS5 index over message text and the triggers that maintain it.
+
+    The index uses the ``message_text`` view as its external content table,
+    so the text is not stored twice and compressed bodies are indexed by
+    their expanded text. Some SQLite builds ship without FTS5; search then
+    falls back to a LIKE scan.
+    """
+    row = c.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+    if row and "message_text" not in row[0]:
+        # Indexes built before compressed bodies read messages.content
+        # directly; rebuild them against the view.
+        for trigger in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+            c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        c.execute("DROP TABLE messages_fts")
+        row = None
+    try:
+        c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                        content, content='message_text', content_rowid='id',
+                        tokenize='porter unicode61'
+                    )''')
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable: {e}")
+        return
+    _create_fts_triggers(c)
+    if not row:
+        print("Building full-text search index...")
+        c.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def _create_fts_triggers(c):
+    """Keep the FTS index in step with messages whose text is stored inline.
+
+    The triggers only use plain SQL, so the database stays writable from the
+    sqlite3 shell and other tools that do not have decode_body(). Messages
+    with compressed bodies are indexed and unindexed by _index_body() and
+    _unindex_bodies() instead.
+    """
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages
+                 WHEN new.content IS NOT NULL BEGIN
+                    INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages
+                 WHEN old.content IS NOT NULL BEGIN
+                    INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content, body_id ON messages BEGIN
+                    INSERT INTO messages_fts(messages_fts, rowid, content)
+                        SELECT 'delete', old.id, old.content WHERE old.content IS NOT NULL;
+                    INSERT INTO messages_fts(rowid, content)
+                        SELECT new.id, new.content WHERE new.content IS NOT NULL;
+                END''')
+
+def _migrate_hot_path_indexes(c):
+    """Index the lookups made on every session switch and tree refresh.
+
+    messages(session_id) lookups are already served by the leading column of
+    idx_messages_session_ordinal.
+    """
+    c.execute("CREATE INDEX IF NOT EXISTS idx_input_history_session_time ON input_history(session_id, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_parent ON sessions(parent_id)")
+    c.execute("ANALYZE")
+
+def _migrate_message_sources(c):
+    """Record which URL a message belongs to so it can be found without matching content.
+
+    Backfills the user message holding each ingested URL and the assistant
+    confirmation that followed it.
+    """
+    if 'source' not in _table_columns(c, 'messages'):
+        c.execute('ALTER TABLE messages ADD COLUMN source TEXT')
+    c.execute('''UPDATE messages SET source = content
+                 WHERE role = 'user' AND source IS NULL
+                   AND (content GLOB 'http://*' OR content GLOB 'https://*')
+                   AND content NOT GLOB ?''', ("*[ \t\r\n]*",))
+    prefix = "Retrieved and stored content from "
+    c.execute('''UPDATE messages SET source = substr(content, ?)
+                 WHERE role = 'assistant' AND source IS NULL AND substr(content, 1, ?) = ?''',
+              (len(prefix) + 1, len(prefix), prefix))
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_source ON messages(session_id, source) WHERE source IS NOT NULL")
+
+def _migrate_token_counts(c):
+    """Cache each message's token count so context assembly does not re-tokenize history."""
+    if 'tokens' not in _table_columns(c, 'messages'):
+        c.execute('ALTER TABLE messages ADD COLUMN tokens INTEGER')
+
+def _migrate_session_summaries(c):
+    """Store a rolling summary of each long session's older messages.
+
+    The summary covers messages up to ``through_ordinal`` and is sent in their
+    place; the messages themselves are kept for display and search.
+    """
+    c.execute('''CREATE TABLE IF NOT EXISTS session_summaries (
+                    session_id INTEGER PRIMARY KEY,
+                    through_ordinal INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(session_id) REFERENCES sessions(id)
+                )''')
+
+def _migrate_portable_fts_triggers(c):
+    """Replace FTS triggers that called decode_body() with ones that only use plain SQL.
+
+    The old triggers failed with "no such function" on any write made
+    outside this module. The index itself is unchanged.
+    """
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone():
+        return
+    for trigger in ("messages_fts_ai", "messages_fts_ad", "messages_fts_au"):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_fts_triggers(c)
+
+MIGRATIONS = [
+    (1, "base tables", _migrate_base_tables),
+    (2, "message ids and ordinals", _migrate_keyed_messages),
+    (3, "shared message bodies", _migrate_message_bodies),
+    (4, "full-text message index", _migrate_fts),
+    (5, "hot path indexes", _migrate_hot_path_indexes),
+    (6, "message sources", _migrate_message_sources),
+    (7, "message token counts", _migrate_token_counts),
+    (8, "session summaries", _migrate_session_summaries),
+    (9, "portable full-text triggers", _migrate_portable_fts_triggers),
+]
+
+def get_schema_version():
+    row = get_connection().execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate():
+    """Apply every migration newer than the database's schema version."""
+    with transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                            version INTEGER PRIMARY KEY,
+                            description TEXT,
+                            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                        )''')
+    current = get_schema_version()
+    if current > MIGRATIONS[-1][0]:
+        print(f"Database schema version {current} is newer than this client supports ({MIGRATIONS[-1][0]}).")
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying database migration {version}: {description}")
+        with _migration_transaction() as conn:
+            migration(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+
+@contextmanager
+def _migration_transaction():
+    """Run one migration, DDL included, as a single transaction.
+
+    In its default mode sqlite3 only opens a transaction before INSERT,
+    UPDATE and DELETE, so CREATE, DROP and ALTER would each commit on their
+    own and a failed migration could leave half of its tables behind. With
+    isolation_level None the transaction is managed here explicitly.
+    """
+    conn = get_connection()
+    conn.commit()
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.isolation_level = "IMMEDIATE"
+
+def init_db():
+    global FTS_ENABLED
+    migrate()
+    with transaction() as conn:
+        _purge_unused_bodies(conn.cursor())
+    FTS_ENABLED = get_connection().execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone() is not None
+    load_settings()
+    set_body_compression(get_setting_bool("compress_messages"))
+
+def _purge_unused_bodies(c):
+    """Delete stored bodies that no message refers to any more.
+
+    Runs at startup rather than on every delete, since a body can be shared
+    by many messages.
+    """
+    c.execute('''DELETE FROM message_bodies
+                 WHERE NOT EXISTS (SELECT 1 FROM messages WHERE messages.body_id = message_bodies.id)''')
+
+def set_body_compression(enabled):
+    """Turn compressed, deduplicated storage of large message bodies on or off for new writes."""
+    global COMPRESS_BODIES
+    COMPRESS_BODIES = bool(enabled)
+
+def _store_body(conn, content, compress=None):
+    """Return the ``(content, body_id)`` pair to store for a message's text.
+
+    Large bodies are stored once per distinct text in ``message_bodies`` when
+    compression is on; everything else is kept inline. ``compress`` overrides
+    the compress_messages setting for this call.
+    """
+    if compress is None:
+        compress = COMPRESS_BODIES
+    if not compress or content is None or len(content) < COMPRESS_MIN_SIZE:
+        return content, None
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    row = conn.execute("SELECT id FROM message_bodies WHERE hash = ?", (digest,)).fetchone()
+    if row:
+        return None, row[0]
+    codec, data = _encode_body(content)
+    c = conn.execute("INSERT INTO message_bodies (hash, codec, data) VALUES (?, ?, ?)", (digest, codec, data))
+    return None, c.lastrowid
+
+def _index_body(conn, message_id, text):
+    """Add a message stored in message_bodies to the FTS index; the triggers skip those."""
+    if FTS_ENABLED:
+        conn.execute("INSERT INTO messages_fts(rowid, content) VALUES (?, ?)", (message_id, text))
+
+def _unindex_bodies(conn, where, params):
+    """Remove FTS entries of messages stored in message_bodies matching ``where``, before they are deleted."""
+    if FTS_ENABLED:
+        conn.execute(
+            "INSERT INTO messages_fts(messages_fts, rowid, content) "
+            "SELECT 'delete', m.id, decode_body(b.codec, b.data) "
+            "FROM messages m JOIN message_bodies b ON b.id = m.body_id "
+            "WHERE m.content IS NULL AND " + where,
+            params,
+        )
+
+def compact_message_bodies(batch_size=500):
+    """Move existing large inline messages into compressed, deduplicated storage.
+
+    Works through the table in batches so each transaction stays short.
+    Returns ``(messages_moved, bytes_before, bytes_after)``.
+    """
+    flush_writes()
+    moved = before = after = 0
+    last_id = 0
+    while True:
+        with transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, content FROM messages WHERE id > ? AND body_id IS NULL AND length(content) >= ? ORDER BY id LIMIT ?",
+                (last_id, COMPRESS_MIN_SIZE, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+            for message_id, content in rows:
+                _content, body_id = _store_body(conn, content, compress=True)
+                conn.execute("UPDATE messages SET content = NULL, body_id = ? WHERE id = ?", (body_id, message_id))
+                _index_body(conn, message_id, content)
+                moved += 1
+                before += len(content.encode("utf-8"))
+            last_id = rows[-1][0]
+    with transaction() as conn:
+        after = conn.execute("SELECT COALESCE(SUM(length(data)), 0) FROM message_bodies").fetchone()[0]
+    return moved, before, after
+
+def save_system_prompt(title, prompt):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO system_prompts (title, prompt) VALUES (?, ?)", (title, prompt))
+
+def get_system_prompts():
+    c = get_connection().execute("SELECT id, title, prompt FROM system_prompts ORDER BY title")
+    return c.fetchall()
+
+def delete_system_prompt(prompt_id):
+    with transaction() as conn:
+        conn.execute("DELETE FROM system_prompts WHERE id = ?", (prompt_id,))
+
+def load_settings():
+    """Read the whole settings table into the in-memory cache and return it."""
+    global _settings
+    rows = get_connection().execute("SELECT key, value FROM settings").fetchall()
+    _settings = dict(rows)
+    return _settings
+
+def get_setting(key, default=None):
+    settings = _settings if _settings is not None else load_settings()
+    return settings.get(key, default)
+
+def get_setting_bool(key, default=False):
+    """Return a setting saved from a bool; save_setting stores those as "True"/"False"."""
+    value = get_setting(key)
+    return default if value is None else value == "True"
+
+def get_setting_int(key, default=0):
+    value = get_setting(key)
+    try:
+        return int(value) if value is not None else default
+    except ValueError:
+        return default
+
+def save_setting(key, value):
+    """Write a setting through to the database and the in-memory cache."""
+    value = str(value)
+    if _settings is not None and _settings.get(key) == value:
+        return
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+    if _settings is not None:
+        _settings[key] = value
+
+def get_sessions():
+    c = get_connection().execute("SELECT id, name, model, system_prompt, system_prompt_id, parent_id, type FROM sessions ORDER BY id")
+    return c.fetchall()
+
+def create_session(name, model='gpt-3.5-turbo', system_prompt='', type='chat', parent_id=None, system_prompt_id=None):
+    with transaction() as conn:
+        c = conn.execute(
+            "INSERT INTO sessions (name, model, system_prompt, system_prompt_id, type, parent_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, model, system_prompt, system_prompt_id, type, parent_id),
+        )
+    return c.lastrowid
+
+
+def import_session(name, model, system_prompt, messages, parent_id=None):
+    """Create a chat session holding ``messages`` in a single transaction.
+
+    ``messages`` is an iterable of ``(role, content)`` pairs and is inserted
+    with one executemany call. Returns the new session id.
+    """
+    with transaction() as conn:
+        c = conn.execute(
+            "INSERT INTO sessions (name, model, system_prompt, type, parent_id) VALUES (?, ?, ?, 'chat', ?)",
+            (name, model, system_prompt, parent_id),
+        )
+        session_id = c.lastrowid
+        rows = []
+        stored_bodies = []
+        for i, (role, content) in enumerate(messages, 1):
+            row = (session_id, i, role) + _store_body(conn, content)
+            if row[4] is not None:
+                stored_bodies.append((i, content))
+            rows.append(row)
+        conn.executemany(
+            "INSERT INTO messages (session_id, ordinal, role, content, body_id) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        for ordinal, content in stored_bodies:
+            message_id = conn.execute("SELECT id FROM messages WHERE session_id = ? AND ordinal = ?",
+                                      (session_id, ordinal)).fetchone()[0]
+            _index_body(conn, message_id, content)
+    return session_id
+
+
+def update_session_model(session_id, model):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET model = ? WHERE id = ?", (model, session_id))
+
+
+def update_session_system_prompt(session_id, system_prompt):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET system_prompt = ? WHERE id = ?", (system_prompt, session_id))
+
+def update_session_system_prompt_id(session_id, prompt_id):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET system_prompt_id = ? WHERE id = ?", (prompt_id, session_id))
+
+def update_session_parent(session_id, parent_id):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET parent_id = ? WHERE id = ?", (parent_id, session_id))
+
+_MESSAGE_SELECT = (
+    "SELECT m.id, m.ordinal, m.role, COALESCE(m.content, decode_body(b.codec, b.data)) "
+    "FROM messages m LEFT JOIN message_bodies b ON b.id = m.body_id"
+)
+
+def get_messages(session_id, before=None, limit=None):
+    """Return ``(id, ordinal, role, content)`` rows for a session, oldest first.
+
+    With ``limit`` only the newest ``limit`` messages older than the ordinal
+    ``before`` are returned, so callers can page backwards through a long
+    session using the ordinal of the first row they already have. Both forms
+    are served from the ``(session_id, ordinal)`` index.
+
+    Messages still waiting in the write-behind queue are included with an id
+    of None and provisional ordinals.
+    """
+    conn = get_connection()
+    with _write_queue.lock:
+        if limit is None and before is None:
+            c = conn.execute(_MESSAGE_SELECT + " WHERE m.session_id = ? ORDER BY m.ordinal", (session_id,))
+            rows = c.fetchall()
+        else:
+            c = conn.execute(
+                _MESSAGE_SELECT + " WHERE m.session_id = ? AND m.ordinal < ? ORDER BY m.ordinal DESC LIMIT ?",
+                (session_id, 2 ** 62 if before is None else before, -1 if limit is None else limit),
+            )
+            rows = list(reversed(c.fetchall()))
+        pending = _write_queue.pending("message", session_id) if before is None else []
+    if pending:
+        if rows:
+            last = rows[-1][1]
+        else:
+            c = conn.execute("SELECT COALESCE(MAX(ordinal), 0) FROM messages WHERE session_id = ?", (session_id,))
+            last = c.fetchone()[0]
+        rows += [(None, last + i, role, content) for i, (_sid, role, content, _source) in enumerate(pending, 1)]
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else []
+    return rows
+
+def get_messages_after(session_id, after, limit):
+    """Return the oldest ``limit`` saved messages with an ordinal above ``after``, as get_messages() rows."""
+    c = get_connection().execute(
+        _MESSAGE_SELECT + " WHERE m.session_id = ? AND m.ordinal > ? ORDER BY m.ordinal LIMIT ?",
+        (session_id, after, limit),
+    )
+    return c.fetchall()
+
+def has_earlier_messages(session_id, ordinal):
+    """Return True if the session has messages before ``ordinal``."""
+    c = get_connection().execute("SELECT 1 FROM messages WHERE session_id = ? AND ordinal < ? LIMIT 1", (session_id, ordinal))
+    return c.fetchone() is not None
+
+def get_message_token_counts(session_id, after=0):
+    """Return the cached ``{message_id: tokens}`` of a session's messages after ordinal ``after``.
+
+    Counts still waiting in the write-behind queue are included.
+    """
+    with _write_queue.lock:
+        c = get_connection().execute(
+            "SELECT id, tokens FROM messages WHERE session_id = ? AND ordinal > ? AND tokens IS NOT NULL",
+            (session_id, after))
+        counts = dict(c.fetchall())
+        for _sid, pending in _write_queue.pending("token_counts", session_id):
+            counts.update(pending)
+    return counts
+
+def queue_token_counts(session_id, counts):
+    """Cache token counts of a session's messages, given as ``{message_id: tokens}``, in the background."""
+    _write_queue.put("token_counts", session_id, counts)
+
+def _save_token_counts(conn, session_id, counts):
+    conn.executemany("UPDATE messages SET tokens = ? WHERE id = ?",
+                     [(tokens, message_id) for message_id, tokens in counts.items()])
+
+def get_session_summary(session_id):
+    """Return ``(through_ordinal, content, tokens)`` for the session's summary, or None."""
+    c = get_connection().execute(
+        "SELECT through_ordinal, content, tokens FROM session_summaries WHERE session_id = ?", (session_id,))
+    return c.fetchone()
+
+def save_session_summary(session_id, through_ordinal, content, tokens):
+    """Replace the session's summary with one covering messages up to ``through_ordinal``."""
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO session_summaries (session_id, through_ordinal, content, tokens) VALUES (?, ?, ?, ?)",
+            (session_id, through_ordinal, content, tokens),
+        )
+
+def _insert_message(conn, session_id, role, content, source=None):
+    inline, body_id = _store_body(conn, content)
+    c = conn.execute(
+        "INSERT INTO messages (session_id, ordinal, role, content, body_id, source) "
+        "SELECT ?, COALESCE(MAX(ordinal), 0) + 1, ?, ?, ?, ? FROM messages WHERE session_id = ?",
+        (session_id, role, inline, body_id, source, session_id),
+    )
+    if body_id is not None:
+        _index_body(conn, c.lastrowid, content)
+    return c.lastrowid
+
+def save_message(session_id, role, content, source=None):
+    """Append a message to a session and return its id.
+
+    ``source`` records the URL or file a message was created for, so the
+    messages can be found again with get_message_ids_for_source().
+    """
+    flush_writes()
+    with transaction() as conn:
+        return _insert_message(conn, session_id, role, content, source)
+
+def get_message_ids_for_source(session_id, source):
+    flush_writes()
+    c = get_connection().execute("SELECT id FROM messages WHERE session_id = ? AND source = ?", (session_id, source))
+    return [row[0] for row in c.fetchall()]
+
+def delete_messages(message_ids):
+    """Delete messages by id, dropping any session summary that covered them."""
+    flush_writes()
+    ids = [(message_id,) for message_id in message_ids]
+    with transaction() as conn:
+        conn.executemany(
+            '''DELETE FROM session_summaries WHERE session_id = (
+                   SELECT session_id FROM messages WHERE id = ? AND ordinal <= session_summaries.through_ordinal)''',
+            ids,
+        )
+        for (message_id,) in ids:
+            _unindex_bodies(conn, "m.id = ?", (message_id,))
+        conn.executemany("DELETE FROM messages WHERE id = ?", ids)
+
+def _insert_input_history(conn, session_id, content):
+    conn.execute("INSERT INTO input_history (session_id, content) VALUES (?, ?)", (session_id, content))
+
+def save_input_history(session_id, content):
+    flush_writes()
+    with transaction() as conn:
+        _insert_input_history(conn, session_id, content)
+
+def get_input_history(session_id, limit=INPUT_HISTORY_LIMIT):
+    with _write_queue.lock:
+        c = get_connection().execute("SELECT content FROM input_history WHERE session_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?", (session_id, limit))
+        history = [row[0] for row in c.fetchall()]
+        pending = [content for _sid, content in _write_queue.pending("input_history", session_id)]
+    return (list(reversed(history)) + pending)[-limit:]
+
+_QUEUED_WRITERS = {
+    "message": _insert_message,
+    "input_history": _insert_input_history,
+    "token_counts": _save_token_counts,
+}
+
+def delete_input_history_for_session(session_id):
+    flush_writes()
+    with transaction() as conn:
+        conn.execute("DELETE FROM input_history WHERE session_id = ?", (session_id,))
+
+def update_session_name(session_id, new_name):
+    with transaction() as conn:
+        conn.execute("UPDATE sessions SET name = ? WHERE id = ?", (new_name, session_id))
+
+def delete_session_and_messages(session_id):
+    flush_writes()
+    with transaction() as conn:
+        _unindex_bodies(conn, "m.session_id = ?", (session_id,))
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM input_history WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM session_summaries WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+_SUBTREE = '''WITH RECURSIVE subtree(id) AS (
+                  SELECT id FROM sessions WHERE id = ?
+                  UNION
+                  SELECT s.id FROM sessions s JOIN subtree ON s.parent_id = subtree.id
+              )'''
+
+def get_session_subtree(session_id):
+    """Return ``(id, type)`` for a session and everything nested beneath it."""
+    c = get_connection().execute(
+        _SUBTREE + " SELECT s.id, s.type FROM sessions s JOIN subtree ON s.id = subtree.id",
+        (session_id,),
+    )
+    return c.fetchall()
+
+def delete_session_tree(session_id):
+    """Delete a session or folder and all of its descendants in one transaction.
+
+    Returns the ids of every session that was removed.
+    """
+    flush_writes()
+    with transaction() as conn:
+        ids = [(row[0],) for row in conn.execute(_SUBTREE + " SELECT id FROM subtree", (session_id,))]
+        for (tree_id,) in ids:
+            _unindex_bodies(conn, "m.session_id = ?", (tree_id,))
+        conn.executemany("DELETE FROM messages WHERE session_id = ?", ids)
+        conn.executemany("DELETE FROM input_history WHERE session_id = ?", ids)
+        conn.executemany("DELETE FROM session_summaries WHERE session_id = ?", ids)
+        conn.executemany("DELETE FROM sessions WHERE id = ?", ids)
+    return [row[0] for row in ids]
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query matching every word, the last as a prefix."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def search_messages(query, limit=100):
+    """Search every session's messages for ``query``.
+
+    Returns ``(message_id, session_id, session_name, ordinal, role, snippet)``
+    rows, best matches first. Matched words in the snippet are wrapped in
+    square brackets.
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+    flush_writes()
+    conn = get_connection()
+    if FTS_ENABLED:
+        c = conn.execute(
+            '''SELECT m.id, m.session_id, s.name, m.ordinal, m.role,
+                      snippet(messages_fts, 0, '[', ']', '...', 16)
+               FROM messages_fts
+               JOIN messages m ON m.id = messages_fts.rowid
+               JOIN sessions s ON s.id = m.session_id
+               WHERE messages_fts MATCH ?
+               ORDER BY rank LIMIT ?''',
+            (match, limit),
+        )
+        return c.fetchall()
+    c = conn.execute(
+        '''SELECT m.id, m.session_id, s.name, m.ordinal, m.role, substr(t.content, 1, 120)
+           FROM message_text t
+           JOIN messages m ON m.id = t.id
+           JOIN sessions s ON s.id = m.session_id
+           WHERE t.content LIKE ? ORDER BY m.id DESC LIMIT ?''',
+        (f"%{query}%", limit),
+    )
+    return c.fetchall()
+
+def count_messages_from(session_id, ordinal):
+    """Return how many messages of a session have an ordinal of at least ``ordinal``."""
+    c = get_connection().execute("SELECT COUNT(*) FROM messages WHERE session_id = ? AND ordinal >= ?", (session_id, ordinal))
+    return c.fetchone()[0]
+
+# --- Cold storage ---
+#
+# Chats that have not been used for a while can be moved to a separate archive
+# database next to the main one, which keeps the main file small so startup,
+# tree loads and backups stay fast. The archive is attached to the connection
+# only when needed. Archived message bodies are always compressed, and ids are
+# kept so a rehydrated chat comes back unchanged.
+
+ARCHIVE_SCHEMA = "archive"
+
+def get_archive_path(db_path=None):
+    """Return the archive database that belongs to ``db_path`` (default: the current database)."""
+    root, _ext = os.path.splitext(db_path or DB_PATH)
+    return root + ".archive.db"
+
+def _attach_archive():
+    """Attach the archive database to this thread's connection, creating it if needed."""
+    conn = get_connection()
+    attached = [row[1] for row in conn.execute("PRAGMA database_list")]
+    if ARCHIVE_SCHEMA in attached:
+        return conn
+    conn.execute("ATTACH DATABASE ? AS archive", (get_archive_path(),))
+    with transaction():
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive.sessions (
+                            id INTEGER PRIMARY KEY,
+                            name TEXT NOT NULL,
+                            model TEXT,
+                            system_prompt TEXT,
+                            system_prompt_id INTEGER,
+                            parent_id INTEGER,
+                            type TEXT,
+                            last_active DATETIME,
+                            archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive.messages (
+                            id INTEGER PRIMARY KEY,
+                            session_id INTEGER NOT NULL,
+                            ordinal INTEGER NOT NULL,
+                            role TEXT,
+                            codec TEXT,
+                            data BLOB,
+                            created_at DATETIME,
+                            source TEXT
+                        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_messages_session ON messages(session_id, ordinal)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS archive.input_history (
+                            id INTEGER PRIMARY KEY,
+                            session_id INTEGER NOT NULL,
+                            content TEXT,
+                            timestamp DATETIME
+                        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_input_history_session ON input_history(session_id)")
+    return conn
+
+def get_inactive_sessions(days):
+    """Return ids of chats whose newest message is more than ``days`` days old.
+
+    Messages saved before timestamps were recorded have no created_at, so a
+    chat with no dated messages, or no messages at all, counts as inactive.
+    """
+    flush_writes()
+    c = get_connection().execute(
+        '''SELECT s.id FROM sessions s
+           LEFT JOIN (SELECT session_id, MAX(created_at) AS last_active FROM messages GROUP BY session_id) m
+             ON m.session_id = s.id
+           WHERE s.type = 'chat' AND (m.last_active IS NULL OR m.last_active < datetime('now', ?))''',
+        (f"-{int(days)} days",),
+    )
+    return [row[0] for row in c.fetchall()]
+
+def archive_sessions(session_ids):
+    """Move chats with their messages and input history into the archive database.
+
+    Folders are skipped. Returns the number of chats archived.
+    """
+    flush_writes()
+    conn = _attach_archive()
+    archived = 0
+    with transaction():
+        for session_id in session_ids:
+            c = conn.execute(
+                '''INSERT OR REPLACE INTO archive.sessions
+                       (id, name, model, system_prompt, system_prompt_id, parent_id, type, last_active)
+                   SELECT id, name, model, system_prompt, system_prompt_id, parent_id, type,
+                          (SELECT MAX(created_at) FROM messages WHERE session_id = sessions.id)
+                   FROM sessions WHERE type = 'chat' AND id = ?''',
+                (session_id,),
+            )
+            if not c.rowcount:
+                continue
+            rows = conn.execute(
+                "SELECT m.id, m.ordinal, m.role, m.content, b.codec, b.data, m.created_at, m.source "
+                "FROM messages m LEFT JOIN message_bodies b ON b.id = m.body_id WHERE m.session_id = ?",
+                (session_id,),
+            ).fetchall()
+            conn.executemany(
+                "INSERT OR REPLACE INTO archive.messages (id, session_id, ordinal, role, codec, data, created_at, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(_id, session_id, ordinal, role,
+                  *_encode_body(content if content is not None else _decode_body(codec, data, strict=True) or ""),
+                  created_at, source)
+                 for _id, ordinal, role, content, codec, data, created_at, source in rows],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO archive.input_history (id, session_id, content, timestamp) "
+                "SELECT id, session_id, content, timestamp FROM input_history WHERE session_id = ?",
+                (session_id,),
+            )
+            _unindex_bodies(conn, "m.session_id = ?", (session_id,))
+            conn.execute("DELETE FROM main.messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM main.input_history WHERE session_id = ?", (session_id,))
+            # The summary is not archived; it is rebuilt if the chat is restored and continued.
+            conn.execute("DELETE FROM main.session_summaries WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM main.sessions WHERE id = ?", (session_id,))
+            archived += 1
+    # Bodies that were only used by archived messages are no longer needed here.
+    with transaction():
+        _purge_unused_bodies(conn)
+    return archived
+
+def get_archived_sessions():
+    """Return ``(id, name, model, last_active, archived_at, message_count)`` for every archived chat."""
+    if not os.path.exists(get_archive_path()):
+        return []
+    c = _attach_archive().execute(
+        '''SELECT s.id, s.name, s.model, s.last_active, s.archived_at,
+                  (SELECT COUNT(*) FROM archive.messages m WHERE m.session_id = s.id)
+           FROM archive.sessions s ORDER BY s.last_active DESC'''
+    )
+    return c.fetchall()
+
+def rehydrate_session(session_id):
+    """Move an archived chat back into the main database.
+
+    The chat returns to its old folder if that still exists, otherwise to the
+    top level. Returns False if the chat is not in the archive.
+    """
+    flush_writes()
+    conn = _attach_archive()
+    with transaction():
+        c = conn.execute(
+            '''INSERT OR REPLACE INTO main.sessions (id, name, model, system_prompt, system_prompt_id, parent_id, type)
+               SELECT a.id, a.name, a.model, a.system_prompt, a.system_prompt_id,
+                      (SELECT p.id FROM main.sessions p WHERE p.id = a.parent_id), a.type
+               FROM archive.sessions a WHERE a.id = ?''',
+            (session_id,),
+        )
+        if not c.rowcount:
+            return False
+        rows = conn.execute(
+            "SELECT id, ordinal, role, codec, data, created_at, source FROM archive.messages WHERE session_id = ? ORDER BY ordinal",
+            (session_id,),
+        ).fetchall()
+        for _id, ordinal, role, codec, data, created_at, source in rows:
+            content = _decode_body(codec, data, strict=True)
+            inline, body_id = _store_body(conn, content)
+            conn.execute(
+                "INSERT OR REPLACE INTO main.messages (id, session_id, ordinal, role, content, created_at, body_id, source) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (_id, session_id, ordinal, role, inline, created_at, body_id, source),
+            )
+            if body_id is not None:
+                _index_body(conn, _id, content)
+        conn.execute(
+            "INSERT OR REPLACE INTO main.input_history (id, session_id, content, timestamp) "
+            "SELECT id, session_id, content, timestamp FROM archive.input_history WHERE session_id = ?",
+            (session_id,),
+        )
+        conn.execute("DELETE FROM archive.messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM archive.input_history WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM archive.sessions WHERE id = ?", (session_id,))
+    return True
+
+def vacuum_db():
+    """Rebuild the main database file so space freed by archiving is returned to the OS."""
+    flush_writes()
+    get_connection().execute("VACUUM main")
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import chat_db
+
+
+def read_chat_export(path):
+    """Parse a chat exported by ask-client.py.
+
+    Accepts the exported dictionary (``model``, ``messages``,
+    ``system_prompt``) or a bare list of messages. Messages may be
+    ``[role, content]`` pairs or ``{"role": ..., "content": ...}`` objects.
+    Returns a dict with ``name``, ``model``, ``system_prompt`` and
+    ``messages`` as a list of ``(role, content)`` tuples.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    model = "gpt-3.5-turbo"
+    system_prompt = ""
+    if isinstance(data, dict) and "messages" in data:
+        model = data.get("model") or model
+        system_prompt = data.get("system_prompt") or ""
+        raw_messages = data["messages"]
+    elif isinstance(data, list):
+        raw_messages = data
+    else:
+        raise ValueError("Invalid JSON format. Expected a list of messages or a dictionary with 'model' and 'messages'.")
+
+    if not isinstance(raw_messages, list):
+        raise ValueError("'messages' must be a list.")
+    messages = []
+    for item in raw_messages:
+        if isinstance(item, dict):
+            role, content = item.get("role"), item.get("content")
+        elif isinstance(item, (list, tuple)) and len(item) >= 2:
+            role, content = item[0], item[1]
+        else:
+            raise ValueError(f"Unrecognised message entry: {item!r}")
+        if not isinstance(role, str) or not isinstance(content, str):
+            raise ValueError(f"Message role and content must be strings: {item!r}"[:200])
+        messages.append((role, content))
+
+    return {
+        "name": os.path.splitext(os.path.basename(path))[0],
+        "model": model,
+        "system_prompt": system_prompt,
+        "messages": messages,
+    }
+
+
+def iter_export_files(paths):
+    """Yield every .json file in ``paths``, descending into directories."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(".json"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def import_chat_files(paths, parent_id=None, progress=None):
+    """Import many exported chats, one transaction per chat.
+
+    Files are read one at a time so memory use does not grow with the number
+    of files. A file that cannot be read or stored is recorded in ``errors``
+    and the import carries on. ``progress`` is called as ``progress(stats)``
+    after each file. Returns a stats dict including the created
+    ``session_ids`` and the elapsed ``seconds``.
+    """
+    chat_db.flush_writes()
+    stats = {"files": 0, "sessions": 0, "messages": 0, "errors": [], "session_ids": [], "seconds": 0.0}
+    started = time.perf_counter()
+    for path in iter_export_files(paths):
+        stats["files"] += 1
+        try:
+            chat = read_chat_export(path)
+            session_id = chat_db.import_session(
+                chat["name"], chat["model"], chat["system_prompt"], chat["messages"], parent_id=parent_id
+            )
+        except (OSError, ValueError, TypeError, sqlite3.Error) as e:
+            stats["errors"].append((path, str(e)))
+        else:
+            stats["sessions"] += 1
+            stats["messages"] += len(chat["messages"])
+            stats["session_ids"].append(session_id)
+        stats["seconds"] = time.perf_counter() - started
+        if progress:
+            progress(stats)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def format_import_stats(stats):
+    seconds = max(stats["seconds"], 1e-9)
+    summary = (
+        f"Imported {stats['sessions']} chats ({stats['messages']} messages) in {stats['seconds']:.2f}s "
+        f"({stats['sessions'] / seconds:.0f} chats/s, {stats['messages'] / seconds:.0f} messages/s)"
+    )
+    if stats["errors"]:
+        summary += f", {len(stats['errors'])} failed"
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import exported chats into a chat database.")
+    parser.add_argument("paths", nargs="+", help="Exported chat .json files or directories containing them")
+    parser.add_argument("--db", type=str, default=chat_db.DB_PATH, help="Path to the chat database file")
+    parser.add_argument("--folder", type=str, help="Create a folder with this name and import into it")
+    args = parser.parse_args()
+
+    chat_db.set_db_path(args.db)
+    chat_db.init_db()
+    parent_id = chat_db.create_session(args.folder, type="folder") if args.folder else None
+
+    stats = import_chat_files(args.paths, parent_id=parent_id)
+    for path, error in stats["errors"]:
+        print(f"❌ {path}: {error}")
+    print(format_import_stats(stats))
+    chat_db.close_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Context window, in tokens, of models the client is commonly pointed at.
+# Looked up by prefix, longest match first, so "gpt-4o-mini" finds "gpt-4o".
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-5": 400000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4-mini": 200000,
+    "claude": 200000,
+    "gemini": 1048576,
+    "llama3": 8192,
+    "mistral": 32768,
+}
+# Used for models not listed above; small enough for most local models.
+DEFAULT_CONTEXT_TOKENS = 8192
+# Room left in the window for the reply, at most a quarter of the window.
+REPLY_RESERVE_TOKENS = 4096
+# Tokens each message costs beyond its text (role and separators).
+MESSAGE_OVERHEAD_TOKENS = 4
+# Newest messages that are always sent verbatim and never summarized.
+SUMMARY_KEEP_RECENT = 8
+# Share of the budget the summary and unsummarized messages may fill before
+# the oldest messages are summarized. Below it everything is sent verbatim.
+SUMMARY_TRIGGER = 0.75
+# Share of the budget one summary request may fold in, so the request itself
+# fits the model's window with the previous summary and the reply.
+SUMMARY_BATCH_SHARE = 0.25
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Merge the existing summary with the new messages into one updated summary. Keep facts, "
+    "decisions, names, code identifiers and open questions the conversation may refer back to. "
+    "Write it in the third person, at most a few paragraphs. Reply with the summary only."
+)
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Count the tokens in ``text``.
+
+    Uses tiktoken's cl100k_base encoding when it is installed, otherwise
+    estimates four characters per token. Either is close enough for budgeting.
+    """
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def context_window(model):
+    """Return the context window of ``model`` in tokens."""
+    name = (model or "").lower().split("/")[-1]
+    for prefix in sorted(MODEL_CONTEXT_TOKENS, key=len, reverse=True):
+        if name.startswith(prefix):
+            return MODEL_CONTEXT_TOKENS[prefix]
+    return DEFAULT_CONTEXT_TOKENS
+
+
+def context_budget(model, limit=0):
+    """Return the tokens a request to ``model`` may spend on its messages.
+
+    ``limit`` caps the budget below what the model allows; 0 means no cap.
+    """
+    window = context_window(model)
+    budget = window - min(REPLY_RESERVE_TOKENS, window // 4)
+    return min(budget, limit) if limit else budget
+
+
+def assemble_context(turns, budget, system_prompt=None, summary=None):
+    """Fit a conversation into ``budget`` tokens.
+
+    ``turns`` are ``{"role", "content", "tokens"}`` dicts, oldest first. The
+    system prompt, the summary of earlier messages and the newest turn are
+    always kept; older turns are added newest first while they fit, and the
+    rest are dropped. Returns the message blocks to send and the number of
+    turns dropped.
+    """
+    used = 0
+    head = []
+    if system_prompt:
+        head.append({"role": "system", "content": system_prompt})
+    if summary:
+        head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    for block in head:
+        used += count_tokens(block["content"]) + MESSAGE_OVERHEAD_TOKENS
+    kept = []
+    for turn in reversed(turns):
+        cost = turn["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        if kept and used + cost > budget:
+            break
+        kept.append({"role": turn["role"], "content": turn["content"]})
+        used += cost
+    kept.reverse()
+    return head + kept, len(turns) - len(kept)
+
+
+def needs_summary(recent, summary_tokens, budget):
+    """Return True if unsummarized history presses on ``budget``.
+
+    ``recent`` are the newest unsummarized turns, oldest first, read until
+    they exceed the budget as session_turns(budget=...) does. Summarizing
+    only starts when there are turns older than the SUMMARY_KEEP_RECENT
+    newest and the summary plus these turns fill SUMMARY_TRIGGER of the
+    budget, so chats that fit are always sent verbatim.
+    """
+    if len(recent) <= SUMMARY_KEEP_RECENT:
+        return False
+    used = summary_tokens + sum(turn["tokens"] + MESSAGE_OVERHEAD_TOKENS for turn in recent)
+    return used > budget * SUMMARY_TRIGGER
+
+
+def summary_batch_tokens(budget):
+    """Return how many tokens of messages one summary request may fold in."""
+    return int(budget * SUMMARY_BATCH_SHARE)
+
+
+def turns_to_summarize(turns, max_tokens):
+    """Return the oldest of ``turns`` that fit one summary batch of ``max_tokens``.
+
+    At least one turn is returned when there are any; a turn too large for
+    the batch on its own is cut to fit.
+    """
+    batch = []
+    used = 0
+    for turn in turns:
+        cost = turn["tokens"] + MESSAGE_OVERHEAD_TOKENS
+        if batch and used + cost > max_tokens:
+            break
+        if cost > max_tokens:
+            turn = dict(turn, content=turn["content"][:max_tokens * 4], tokens=max_tokens)
+        batch.append(turn)
+        used += cost
+    return batch
+
+
+def summary_request(previous, turns):
+    """Return the messages asking the model to extend ``previous`` with ``turns``."""
+    transcript = "\n\n".join(f"{turn['role'].title()}: {turn['content']}" for turn in turns)
+    prompt = f"Existing summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": prompt},
+    ]
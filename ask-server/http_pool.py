@@ -0,0 +1,134 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connections kept open per host. The chat client talks almost exclusively to
+# the proxy, so this bounds how many requests to it can be in flight at once
+# without opening new connections.
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# Seconds to wait for a connection to be established, and for the next byte
+# of a response once it is. Streaming replies can pause while the model
+# thinks, so the read timeout is generous.
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))
+# How often a request that could not connect or got a RETRY_STATUSES reply
+# is retried, and the base and maximum delay between attempts. Delays grow
+# exponentially with full jitter so clients that failed together do not
+# retry together.
+RETRY_ATTEMPTS = int(os.getenv("HTTP_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "30"))
+# Responses worth retrying: rate limiting and transient proxy/upstream failures.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the process-wide requests session, creating it on first use.
+
+    Reusing one session keeps connections to the proxy alive between calls,
+    so only the first request pays for the TCP and TLS handshakes.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def request(method, url, **kwargs):
+    """Send a request through the shared session, with the default timeouts unless given."""
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number ``attempt`` (starting at 0).
+
+    A ``Retry-After`` value from the server is honoured when it asks for longer.
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BACKOFF * 2 ** attempt))
+    try:
+        delay = max(delay, min(RETRY_MAX_DELAY, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+def _never_sent(exc):
+    """Return True if ``exc`` means the request failed before it reached the server.
+
+    Only those failures are safe to retry. A read timeout or a connection
+    dropped while waiting for the response may come after the server took
+    the request, and sending it again would repeat the prompt and its cost.
+    """
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def post_with_retry(url, attempts=RETRY_ATTEMPTS, cancelled=None, on_retry=None, **kwargs):
+    """POST like post(), retrying failed connections and RETRY_STATUSES responses.
+
+    Only failures to connect are retried, never a request that may already
+    have reached the server (see _never_sent), so a read timeout is raised
+    at once. A stream that fails after its response arrived is up to the
+    caller. ``cancelled`` is an optional
+    threading.Event that cuts the wait between attempts short, and
+    ``on_retry(attempt, reason, delay)`` is called before each wait. The last
+    response or error is returned or raised once attempts run out.
+    """
+    attempt = 0
+    while True:
+        try:
+            resp = post(url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if not _never_sent(e) or attempt >= attempts or (cancelled is not None and cancelled.is_set()):
+                raise
+            reason, delay = f"connection failed ({e.__class__.__name__})", backoff_delay(attempt)
+        else:
+            if resp.status_code not in RETRY_STATUSES or attempt >= attempts:
+                return resp
+            reason = f"HTTP {resp.status_code}"
+            delay = backoff_delay(attempt, resp.headers.get("Retry-After"))
+            resp.close()
+        if on_retry:
+            on_retry(attempt + 1, reason, delay)
+        if cancelled is not None:
+            if cancelled.wait(delay):
+                raise requests.exceptions.ConnectionError("Request cancelled while waiting to retry.")
+        else:
+            time.sleep(delay)
+        attempt += 1
+
+
+def close_session():
+    """Close every pooled connection. The next request opens a new session."""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""Stand-in for the proxy, for testing and benchmarking without an OpenAI key.
+
+Serves ``/v1/chat/completions`` (streaming and not), ``/chat`` in the form
+ask.py sends, and ``/mods``. Replies are generated at a configurable token
+rate and time to first byte, with optional failures. It can also sit in
+front of a real proxy and record its streams, and replay those recordings
+byte for byte later.
+
+    python mock_server.py --port 3000 --tokens-per-second 80 --ttfb-ms 400
+    python mock_server.py --record-upstream https://localhost:3000 --record-dir recordings
+    python mock_server.py --replay-dir recordings --replay-speed 0
+
+Point the client at it with PUBLISHED_API=http://127.0.0.1:3000 and ask.py
+with OPENAI_PROXY_URL=http://127.0.0.1:3000/chat.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_MODELS = ["gpt-3.5-turbo", "gpt-4o", "gpt-4o-mini", "mock-model"]
+
+# Replies are cut from this text, repeated as needed. It mixes the markdown
+# the client renders (headings, lists, code, tables) with plain prose and
+# some non-ASCII text so multi-byte characters cross chunk boundaries.
+REPLY_TEXT = """## Overview
+
+This is a **mock reply** used to exercise streaming and rendering. It has *emphasis*, `inline code`, and a [link](https://example.com).
+
+1. First, the model thinks for a moment.
+2. Then it streams tokens at a steady rate.
+3. Finally it sends a `[DONE]` marker.
+
+```python
+def fibonacci(n):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+```
+
+| Metric | Value |
+| ------ | ----- |
+| TTFB   | fast  |
+| Rate   | steady |
+
+Non-ASCII text: café, naïve, Größe, 日本語のテキスト, emoji 🚀✨, and ∑ symbols.
+
+> A blockquote closes the section, followed by more prose to make the reply long enough for throughput measurements.
+
+"""
+_TOKEN_RE = re.compile(r"\s*\S+|\s+")
+REPLY_PIECES = _TOKEN_RE.findall(REPLY_TEXT)
+
+
+def reply_tokens(count):
+    """Return ``count`` token-sized pieces of the mock reply text."""
+    return [REPLY_PIECES[i % len(REPLY_PIECES)] for i in range(count)]
+
+
+def request_key(payload):
+    """Identify a request by its content, for finding its recording."""
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class _ChunkedWriter:
+    """Write an HTTP/1.1 chunked body, optionally re-sliced into fixed-size writes."""
+
+    def __init__(self, wfile, write_bytes=0):
+        self.wfile = wfile
+        self.write_bytes = write_bytes
+
+    def write(self, data):
+        step = self.write_bytes or len(data)
+        for i in range(0, len(data), step or 1):
+            piece = data[i:i + step]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+            self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class MockServer:
+    """The mock proxy. start() serves it on a background thread; url is its base address.
+
+    ``tokens_per_second`` of 0 streams as fast as possible. ``chunk_tokens``
+    tokens go into each SSE event, ``events_per_write`` events into each
+    network write, and ``write_bytes`` re-slices writes into pieces of that
+    many bytes regardless of event or character boundaries. Each request
+    fails with ``fail_status`` with probability ``fail_rate``; streams lose
+    their connection part way with probability ``drop_rate`` and end with
+    an ``[ERROR]`` frame, as ask-server.js sends, with ``error_frame_rate``.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, tokens_per_second=0, ttfb_ms=0, reply_tokens=200,
+                 chunk_tokens=1, events_per_write=1, write_bytes=0, fail_rate=0.0, fail_status=503,
+                 drop_rate=0.0, error_frame_rate=0.0, models=DEFAULT_MODELS, secret=None,
+                 record_upstream=None, record_dir=None, replay_dir=None, replay_speed=1.0,
+                 seed=None, verbose=False):
+        self.tokens_per_second = tokens_per_second
+        self.ttfb_ms = ttfb_ms
+        self.reply_tokens = reply_tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.events_per_write = max(1, events_per_write)
+        self.write_bytes = write_bytes
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.drop_rate = drop_rate
+        self.error_frame_rate = error_frame_rate
+        self.models = list(models)
+        self.secret = secret
+        self.record_upstream = record_upstream.rstrip("/") if record_upstream else None
+        self.record_dir = record_dir
+        self.replay_dir = replay_dir
+        self.replay_speed = replay_speed
+        self.verbose = verbose
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chance(self, rate):
+        if rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        if self.mock.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if self.mock.secret and self.headers.get("x-api-secret") != self.mock.secret:
+            self.send_json(401, {"error": "Unauthorized: Invalid or missing secret token"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        if self.path != "/mods":
+            return self.send_json(404, {"error": "Not found"})
+        data = {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "mock"} for m in self.mock.models]}
+        etag = '"' + hashlib.sha256(json.dumps(data).encode("utf-8")).hexdigest()[:16] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_json(200, data, {"ETag": etag})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.authorized():
+            return
+        if self.path not in ("/v1/chat/completions", "/chat"):
+            return self.send_json(404, {"error": "Not found"})
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": "Invalid JSON"})
+        with self.mock._random_lock:
+            self.mock.requests += 1
+
+        if self.mock.replay_dir:
+            return self.replay(payload)
+        if self.mock.record_upstream:
+            return self.record(payload, body)
+        if self.mock.chance(self.mock.fail_rate):
+            headers = {"Retry-After": "1"} if self.mock.fail_status == 429 else None
+            return self.send_json(self.mock.fail_status, {"error": "Injected failure"}, headers)
+        if not payload.get("messages") and not payload.get("ai"):
+            return self.send_json(400, {"error": "Missing messages content"})
+
+        if self.mock.ttfb_ms:
+            time.sleep(self.mock.ttfb_ms / 1000)
+        tokens = reply_tokens(self.mock.reply_tokens)
+        model = payload.get("model", "gpt-3.5-turbo")
+        if payload.get("stream"):
+            self.stream_reply(model, tokens)
+        else:
+            self.send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+    def start_stream(self, status=200, content_type="text/event-stream"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def drop_connection(self):
+        """Cut the connection without finishing the chunked body, like a network failure."""
+        self.wfile.flush()
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.close_connection = True
+
+    def stream_reply(self, model, tokens):
+        mock = self.mock
+        created = int(time.time())
+
+        def event(delta, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+        groups = [tokens[i:i + mock.chunk_tokens] for i in range(0, len(tokens), mock.chunk_tokens)]
+        cut_at = len(groups) // 2
+        drop = mock.chance(mock.drop_rate)
+        error_frame = not drop and mock.chance(mock.error_frame_rate)
+
+        self.start_stream()
+        out = _ChunkedWriter(self.wfile, mock.write_bytes)
+        pending = [event({"role": "assistant", "content": ""})]
+        started = time.perf_counter()
+        sent = 0
+        try:
+            for index, group in enumerate(groups):
+                if index == cut_at and (drop or error_frame):
+                    if pending:
+                        out.write(b"".join(pending))
+                    if drop:
+                        return self.drop_connection()
+                    out.write(b"data: [ERROR] Injected error\n\n")
+                    out.close()
+                    return
+                pending.append(event({"content": "".join(group)}))
+                sent += len(group)
+                if len(pending) >= mock.events_per_write:
+                    if mock.tokens_per_second:
+                        delay = started + sent / mock.tokens_per_second - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    out.write(b"".join(pending))
+                    pending = []
+            pending.append(event({}, "stop"))
+            pending.append(b"data: [DONE]\n\n")
+            out.write(b"".join(pending))
+            out.close()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def recording_path(self, payload):
+        return os.path.join(self.mock.record_dir or self.mock.replay_dir, request_key(payload) + ".json")
+
+    def record(self, payload, body):
+        """Forward the request to the real proxy, relaying and recording its response."""
+        import http_pool
+
+        headers = {"Content-Type": "application/json"}
+        for name in ("x-api-secret", "Authorization"):
+            if self.headers.get(name):
+                headers[name] = self.headers[name]
+        verify = os.getenv("PROXY_VERIFY_CERT", "True").lower() == "true"
+        started = time.perf_counter()
+        chunks = []
+        with http_pool.post(self.mock.record_upstream + self.path, data=body, headers=headers, stream=True, verify=verify) as resp:
+            content_type = resp.headers.get("Content-Type", "application/json")
+            self.start_stream(resp.status_code, content_type)
+            out = _ChunkedWriter(self.wfile)
+            for data in resp.iter_content(chunk_size=None):
+                chunks.append([round(time.perf_counter() - started, 6), base64.b64encode(data).decode("ascii")])
+                out.write(data)
+            out.close()
+        recording = {"request": payload, "status": resp.status_code, "content_type": content_type, "chunks": chunks}
+        os.makedirs(self.mock.record_dir, exist_ok=True)
+        with open(self.recording_path(payload), "w", encoding="utf-8") as f:
+            json.dump(recording, f)
+
+    def replay(self, payload):
+        """Send a recorded response with its original bytes, chunking and (scaled) timing."""
+        try:
+            with open(self.recording_path(payload), "r", encoding="utf-8") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            return self.send_json(404, {"error": "No recording for this request"})
+        self.start_stream(recording["status"], recording["content_type"])
+        out = _ChunkedWriter(self.wfile, self.mock.write_bytes)
+        started = time.perf_counter()
+        for offset, data in recording["chunks"]:
+            if self.mock.replay_speed:
+                delay = started + offset / self.mock.replay_speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            out.write(base64.b64decode(data))
+        out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock chat completion server for offline testing and benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--tokens-per-second", type=float, default=50, help="Streaming rate; 0 for as fast as possible")
+    parser.add_argument("--ttfb-ms", type=float, default=300, help="Delay before the response starts")
+    parser.add_argument("--reply-tokens", type=int, default=400, help="Length of each generated reply")
+    parser.add_argument("--chunk-tokens", type=int, default=1, help="Tokens per SSE event")
+    parser.add_argument("--events-per-write", type=int, default=1, help="SSE events per network write")
+    parser.add_argument("--write-bytes", type=int, default=0, help="Re-slice writes into pieces of this many bytes")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of streams whose connection is cut midway")
+    parser.add_argument("--error-frame-rate", type=float, default=0.0, help="Fraction of streams ending in a [ERROR] frame")
+    parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="Comma-separated ids served by /mods")
+    parser.add_argument("--secret", default=None, help="Require this x-api-secret header")
+    parser.add_argument("--record-upstream", metavar="URL", help="Proxy requests to URL and record the responses")
+    parser.add_argument("--record-dir", default="recordings", help="Where recordings are written")
+    parser.add_argument("--replay-dir", metavar="DIR", help="Answer requests from recordings in DIR")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay timing multiplier; 0 for as fast as possible")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for failure injection")
+    parser.add_argument("--verbose", action="store_true", help="Log each request")
+    args = parser.parse_args()
+
+    server = MockServer(
+        host=args.host, port=args.port, tokens_per_second=args.tokens_per_second, ttfb_ms=args.ttfb_ms,
+        reply_tokens=args.reply_tokens, chunk_tokens=args.chunk_tokens, events_per_write=args.events_per_write,
+        write_bytes=args.write_bytes, fail_rate=args.fail_rate, fail_status=args.fail_status,
+        drop_rate=args.drop_rate, error_frame_rate=args.error_frame_rate, models=args.models.split(","),
+        secret=args.secret, record_upstream=args.record_upstream,
+        record_dir=args.record_dir if args.record_upstream else None, replay_dir=args.replay_dir,
+        replay_speed=args.replay_speed, seed=args.seed, verbose=args.verbose,
+    )
+    print(f"Mock server listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+# Catalogs from every source are kept in one file in the user's cache
+# directory, so the chat client and openai-models-list.py share it no matter
+# which directory they are started from.
+CATALOG_PATH = os.getenv(
+    "MODEL_CATALOG_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "ask-client", "model_catalog.json"),
+)
+# A cached catalog younger than this is used without asking the source.
+CATALOG_TTL_SECONDS = int(os.getenv("MODEL_CATALOG_TTL_SECONDS", str(6 * 3600)))
+
+_file_lock = threading.Lock()
+
+
+def _load_all(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_entry(path, source, entry):
+    """Write one source's entry into the catalog file, replacing the file atomically."""
+    with _file_lock:
+        data = _load_all(path)
+        data[source] = entry
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".model_catalog.")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class ModelCatalog:
+    """The model list of one source (such as the proxy at API_URL), cached on disk.
+
+    ``fetch(etag)`` asks the source for its models. It returns
+    ``(models, etag)``, or ``(None, etag)`` when the source answered that the
+    list is unchanged since ``etag`` (HTTP 304). models() never waits for the
+    network: it returns the cached list at once and, when that is older than
+    ``ttl`` seconds, starts a refresh on a background thread. Listeners added
+    with add_listener() are called from that thread when the list changes.
+    """
+
+    def __init__(self, source, fetch, ttl=CATALOG_TTL_SECONDS, path=CATALOG_PATH):
+        self.source = source
+        self.fetch = fetch
+        self.ttl = ttl
+        self.path = path
+        self._lock = threading.Lock()
+        self._refreshing = None
+        self._listeners = []
+        self._entry = _load_all(path).get(source) or {}
+
+    @property
+    def age(self):
+        """Seconds since the source last confirmed the cached list, or None if there is none."""
+        checked = self._entry.get("checked_at")
+        return None if checked is None else time.time() - checked
+
+    @property
+    def stale(self):
+        age = self.age
+        return age is None or age > self.ttl
+
+    def models(self, default=None):
+        """Return the cached model ids, refreshing them in the background if they are stale."""
+        if self.stale:
+            self.refresh_async()
+        return list(self._entry.get("models") or default or [])
+
+    def add_listener(self, fn):
+        """Call ``fn(models)`` whenever a refresh changes the list."""
+        self._listeners.append(fn)
+
+    def refresh(self):
+        """Ask the source for its models now, revalidating the cached list if there is one.
+
+        Returns the current list. Errors propagate; the cached list is kept.
+        """
+        fetched, etag = self.fetch(self._entry.get("etag") if self._entry.get("models") else None)
+        entry = dict(self._entry, checked_at=time.time(), etag=etag)
+        changed = fetched is not None and sorted(fetched) != self._entry.get("models")
+        if fetched is not None:
+            entry["models"] = sorted(fetched)
+        self._entry = entry
+        _save_entry(self.path, self.source, entry)
+        if changed:
+            for fn in list(self._listeners):
+                fn(list(entry["models"]))
+        return list(entry.get("models") or [])
+
+    def refresh_async(self):
+        """Start a background refresh unless one is already running."""
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return self._refreshing
+            self._refreshing = threading.Thread(target=self._refresh_quietly, name="model-catalog", daemon=True)
+            self._refreshing.start()
+            return self._refreshing
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error refreshing model list from {self.source}: {e}")
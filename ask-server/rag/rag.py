@@ -161,6 +161,15 @@ def delete_all_files_from_chat(chat_id=None):
     print(f"Total deleted chunks for chat_id '{chat_id}': {total_deleted_chunks}")
     return total_deleted_chunks
 
+def delete_chats_from_rag(chat_ids):
+    """Delete every chunk belonging to any of ``chat_ids`` in a single call."""
+    chat_ids = list(chat_ids)
+    if not chat_ids:
+        return
+    where = {"chat_id": chat_ids[0]} if len(chat_ids) == 1 else {"chat_id": {"$in": chat_ids}}
+    get_rag_processor().collection.delete(where=where)
+    print(f"Deleted chunks for {len(chat_ids)} chat(s) from ChromaDB.")
+
 def query_by_chat_id(chat_id: str, query: str, n_results: int = 5):
     results = get_rag_processor().collection.query(
         query_texts=[query],
@@ -0,0 +1,294 @@
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_pool
+from sse import StreamError, iter_stream_deltas
+
+# Model requests allowed on the wire at once. Further requests wait their turn
+# and can be cancelled while they wait.
+MAX_IN_FLIGHT = http_pool.POOL_SIZE
+# Streamed deltas buffered per request before the reader stops pulling from
+# the socket until the consumer catches up.
+STREAM_BUFFER_SIZE = 256
+# Times a stream that drops mid-reply is re-requested to continue from the
+# text received so far, instead of failing and losing it.
+STREAM_RESUMES = int(os.getenv("STREAM_RESUMES", "2"))
+CONTINUE_PROMPT = ("Your previous reply was cut off. Continue it exactly where it stopped, "
+                   "without repeating any of it or adding a preamble.")
+# Errors that mean the connection broke while a reply was being read. The
+# proxy reports a failed upstream stream with an [ERROR] frame, raised as
+# StreamError, which is resumed the same way.
+STREAM_DROPPED = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+    StreamError,
+)
+
+
+def continuation_payload(payload, partial):
+    """Return ``payload`` asking the model to continue the partial assistant reply."""
+    messages = list(payload["messages"]) + [
+        {"role": "assistant", "content": partial},
+        {"role": "user", "content": CONTINUE_PROMPT},
+    ]
+    return dict(payload, messages=messages)
+
+
+def iter_resilient_deltas(url, payload, cancelled=None, on_response=None, on_retry=None, resumes=STREAM_RESUMES, **kwargs):
+    """Yield the content deltas of a streamed chat completion, surviving flaky links.
+
+    Getting a response is retried with backoff by http_pool.post_with_retry.
+    If the connection drops after part of the reply arrived, the request is
+    sent again with that text appended as an assistant turn, and the
+    continuation is yielded as if the stream had not broken. ``on_response``
+    is called with each response so a caller can close it to cancel, and
+    ``on_retry(reason)`` describes each retry or resume.
+    """
+    def report(attempt, reason, delay):
+        if on_retry:
+            on_retry(f"{reason}, retrying in {delay:.1f}s (attempt {attempt})")
+
+    received = ""
+    base = dict(payload, stream=True)
+    body = base
+    resumed = 0
+    while True:
+        connected = False
+        try:
+            with http_pool.post_with_retry(url, cancelled=cancelled, on_retry=report, json=body, stream=True, **kwargs) as resp:
+                connected = True
+                if on_response:
+                    on_response(resp)
+                resp.raise_for_status()
+                for content_chunk in iter_stream_deltas(resp):
+                    received += content_chunk
+                    yield content_chunk
+            return
+        except STREAM_DROPPED as e:
+            # post_with_retry has already retried failures to connect.
+            if not connected or resumed >= resumes or (cancelled is not None and cancelled.is_set()):
+                raise
+            resumed += 1
+            if on_retry:
+                on_retry(f"Connection lost ({e.__class__.__name__}), resuming reply (attempt {resumed})")
+            body = continuation_payload(base, received) if received else base
+
+
+class RequestHandle:
+    """A request submitted to the RequestCore, which can be cancelled from any thread."""
+
+    def __init__(self, core):
+        self._core = core
+        self._cancelled = threading.Event()
+        self._response = None
+        self._future = None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self._future is not None and self._future.done()
+
+    def cancel(self):
+        """Stop the request. A streaming response is closed immediately."""
+        self._cancelled.set()
+        self._close_response()
+        if self._future is not None:
+            self._future.cancel()
+
+    def _close_response(self):
+        resp = self._response
+        if resp is not None:
+            try:
+                resp.close()
+            except Exception:
+                pass
+
+
+class RequestCore:
+    """Run model requests concurrently from an asyncio event loop on its own thread.
+
+    The loop schedules requests, limits how many are in flight and handles
+    cancellation. The HTTP I/O itself goes through the shared keep-alive
+    session in http_pool, on a thread pool sized to the in-flight limit.
+    Callers get a RequestHandle back immediately; results are delivered as
+    events or callbacks from background threads, so GUI code should pass
+    them through a TkBridge.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, buffer_size=STREAM_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        self.loop = asyncio.new_event_loop()
+        self._limit = asyncio.Semaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="request")
+        self._handles = set()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="request-core", daemon=True)
+        self._thread.start()
+
+    def stream_chat(self, url, payload, events, **kwargs):
+        """Stream a chat completion into ``events``.
+
+        ``events`` should be a ``queue.Queue(maxsize=...)`` so that a slow
+        consumer holds back the reader. It receives ``("delta", text)`` items,
+        ``("retry", reason)`` whenever the request is retried or resumed, and
+        finally exactly one of ``("done", None)``, ``("error", exc)`` or
+        ``("cancelled", None)``.
+        """
+        handle = RequestHandle(self)
+        return self._submit(handle, self._stream(handle, url, payload, events, kwargs))
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        """Run a blocking call such as send_to_api() under the in-flight limit.
+
+        ``on_done(result)`` or ``on_error(exc)`` is called from a worker thread.
+        """
+        handle = RequestHandle(self)
+        return self._submit(handle, self._call(fn, args, on_done, on_error))
+
+    def cancel_all(self):
+        for handle in list(self._handles):
+            handle.cancel()
+
+    def _submit(self, handle, coro):
+        self._handles.add(handle)
+        handle._future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        handle._future.add_done_callback(lambda _f: self._handles.discard(handle))
+        return handle
+
+    async def _call(self, fn, args, on_done, on_error):
+        try:
+            async with self._limit:
+                job = self._executor.submit(fn, *args)
+                try:
+                    result = await asyncio.wrap_future(job)
+                except asyncio.CancelledError:
+                    if not job.cancel():
+                        await self._finish(job)
+                    raise
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            return
+        if on_done:
+            on_done(result)
+
+    async def _stream(self, handle, url, payload, events, kwargs):
+        job = None
+        try:
+            async with self._limit:
+                job = self._executor.submit(self._read_stream, handle, url, payload, events, kwargs)
+                try:
+                    await asyncio.wrap_future(job)
+                except asyncio.CancelledError:
+                    handle._cancelled.set()
+                    handle._close_response()
+                    if not job.cancel():
+                        # The reader is running; it posts the final event itself.
+                        await self._finish(job)
+                    raise
+        except asyncio.CancelledError:
+            if job is None or job.cancelled():
+                # Cancelled before the reader ran, so nothing else will end the stream.
+                handle._cancelled.set()
+                events.put(("cancelled", None))
+            raise
+
+    async def _finish(self, job):
+        """Wait for a running executor job, so its in-flight slot is held until it returns."""
+        while not job.done():
+            try:
+                await asyncio.wait([asyncio.wrap_future(job)])
+            except asyncio.CancelledError:
+                pass
+
+    def _read_stream(self, handle, url, payload, events, kwargs):
+        """Read one streamed response on a worker thread, posting deltas to ``events``."""
+        if handle.cancelled:
+            events.put(("cancelled", None))
+            return
+
+        def on_response(resp):
+            handle._response = resp
+            if handle.cancelled:
+                handle._close_response()
+
+        deltas = iter_resilient_deltas(
+            url, payload, cancelled=handle._cancelled, on_response=on_response,
+            on_retry=lambda reason: self._put(handle, events, ("retry", reason)), **kwargs)
+        try:
+            for content_chunk in deltas:
+                if not self._put(handle, events, ("delta", content_chunk)):
+                    break
+            deltas.close()
+        except Exception as e:
+            events.put(("cancelled", None) if handle.cancelled else ("error", e))
+            return
+        finally:
+            handle._response = None
+        events.put(("cancelled", None) if handle.cancelled else ("done", None))
+
+    def _put(self, handle, events, item):
+        """Put ``item`` on a bounded queue, waiting while it is full unless the request is cancelled."""
+        while not handle.cancelled:
+            try:
+                events.put(item, timeout=0.25)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+
+class TkBridge:
+    """Run callbacks posted from background threads on the Tk main thread.
+
+    Calls are queued and a timer started with after() runs them, so worker
+    threads never touch widgets directly.
+    """
+
+    def __init__(self, root, interval_ms=15):
+        self.root = root
+        self.interval_ms = interval_ms
+        self._calls = queue.Queue()
+        self.root.after(self.interval_ms, self._pump)
+
+    def call(self, fn, *args):
+        """Schedule ``fn(*args)`` on the Tk thread. Safe to call from any thread."""
+        self._calls.put((fn, args))
+
+    def wrap(self, fn):
+        """Return a thread-safe callback that forwards its arguments to ``fn`` on the Tk thread."""
+        return lambda *args: self.call(fn, *args)
+
+    def _pump(self):
+        while True:
+            try:
+                fn, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Error in UI callback {getattr(fn, '__name__', fn)}: {e}")
+        self.root.after(self.interval_ms, self._pump)
+
+
+_core = None
+_core_lock = threading.Lock()
+
+
+def get_core():
+    """Return the process-wide RequestCore, starting it on first use."""
+    global _core
+    with _core_lock:
+        if _core is None:
+            _core = RequestCore()
+        return _core
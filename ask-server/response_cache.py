@@ -0,0 +1,117 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# File holding cached replies, next to recent_dbs.json and the other client
+# state files. Replies do not depend on which chat database is open.
+CACHE_PATH = "response_cache.db"
+DEFAULT_TTL_HOURS = 24 * 7
+DEFAULT_MAX_MB = 50
+
+
+def cache_key(model, messages, **params):
+    """Hash everything that determines a reply into a cache key."""
+    blob = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Model replies stored on disk, keyed by cache_key().
+
+    Entries older than ``ttl_hours`` are ignored and removed. When the stored
+    replies exceed ``max_mb`` the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl_hours=DEFAULT_TTL_HOURS, max_mb=DEFAULT_MAX_MB):
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.max_mb = max_mb
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                  key TEXT PRIMARY KEY,
+                                  model TEXT,
+                                  response TEXT NOT NULL,
+                                  size INTEGER NOT NULL,
+                                  created_at REAL NOT NULL,
+                                  last_used REAL NOT NULL,
+                                  hits INTEGER NOT NULL DEFAULT 0
+                              )''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached reply for ``key``, or None if there is no fresh entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl_hours * 3600:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_hours * 3600,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        limit = self.max_mb * 1024 * 1024
+        if total <= limit:
+            return
+        # Walk from the least recently used entry until enough space is freed.
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total <= limit:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return entry count, stored bytes, and this run's hits, misses and hit rate."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def format_cache_stats(stats):
+    return (f"{stats['entries']} cached replies ({stats['bytes'] // 1024} KB), "
+            f"{stats['hits']} hits / {stats['misses']} misses this session "
+            f"({stats['hit_rate']:.0%} hit rate)")
@@ -0,0 +1,136 @@
+import json
+import sys
+
+# orjson decodes the small JSON deltas of a stream several times faster than
+# the standard library, and is in requirements.txt for that reason. The
+# standard json module is used if it is not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data):
+    # json.loads would accept the bytes too, but sniffs their encoding first.
+    return json.loads(data.decode("utf-8"))
+
+
+loads = orjson.loads if orjson is not None else _json_loads
+
+
+class StreamError(Exception):
+    """The proxy reported that the upstream stream failed, with a ``data: [ERROR]`` frame."""
+
+
+_NO_EVENTS = ()
+
+
+class SSEDecoder:
+    """Incremental server-sent events parser working on raw bytes.
+
+    feed() takes chunks exactly as they come off the socket, which may split
+    lines, events and multi-byte characters anywhere, and returns the data
+    of every event completed so far. Multi-line ``data:`` fields are joined
+    with newlines, as the SSE spec says. Text is never decoded here: JSON
+    parsers take UTF-8 bytes, so a character split across chunks is simply
+    whole again by the time its line is complete.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data = []
+
+    def feed(self, chunk):
+        """Add ``chunk`` and return the data (bytes) of each event it completes."""
+        if b"\n" not in chunk and b"\r" not in chunk:
+            # No line ends: nothing can complete, so just keep the bytes.
+            self._buffer += chunk
+            return _NO_EVENTS
+        if self._buffer:
+            self._buffer += chunk
+            buf = bytes(self._buffer)
+        else:
+            buf = chunk
+        held = b""
+        if b"\r" in buf:
+            # A CR at the very end may be the first half of a CRLF split across chunks.
+            if buf.endswith(b"\r"):
+                buf, held = buf[:-1], b"\r"
+            buf = buf.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        lines = buf.split(b"\n")
+        self._buffer = bytearray(lines.pop() + held)
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append(data[0] if len(data) == 1 else b"\n".join(data))
+                    data = self._data = []
+            elif line.startswith(b"data:"):
+                data.append(line[6:] if line.startswith(b"data: ") else line[5:])
+            # Comments (":...") and the event, id and retry fields are not used.
+        return events
+
+    def flush(self):
+        """Return the data of an event left unterminated when the stream ended."""
+        events = self.feed(b"\n\n") if self._buffer or self._data else []
+        self._buffer = bytearray()
+        return events
+
+
+def iter_sse_batches(chunks):
+    """Yield, per chunk that completes any, the list of event data it completes.
+
+    Batching keeps generator overhead per chunk rather than per event.
+    """
+    decoder = SSEDecoder()
+    feed = decoder.feed
+    for chunk in chunks:
+        events = feed(chunk)
+        if events:
+            yield events
+    events = decoder.flush()
+    if events:
+        yield events
+
+
+def iter_sse_data(chunks):
+    """Yield the data of each event in an iterable of raw byte chunks."""
+    for events in iter_sse_batches(chunks):
+        yield from events
+
+
+def iter_delta_content(chunks):
+    """Yield the content deltas of a streamed chat completion from raw byte chunks.
+
+    Stops at ``[DONE]`` and raises StreamError on an ``[ERROR]`` frame.
+    Events that are not JSON are skipped with a note on stderr.
+    """
+    for events in iter_sse_batches(chunks):
+        for data in events:
+            if data[:1] == b"[":
+                if data == b"[DONE]":
+                    return
+                if data.startswith(b"[ERROR]"):
+                    raise StreamError(data[7:].strip().decode("utf-8", "replace") or "Stream failed")
+            try:
+                event = loads(data)
+            except ValueError:
+                print(f"Skipping non-JSON event: {data[:200].decode('utf-8', 'replace')}", file=sys.stderr)
+                continue
+            choices = event.get("choices") if isinstance(event, dict) else None
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+def iter_stream_deltas(resp):
+    """Yield the content deltas of a streamed chat completion response."""
+    # chunk_size=None hands over data as soon as it arrives, undecoded.
+    chunks = resp.iter_content(chunk_size=None)
+    yield from iter_delta_content(chunks)
+    # [DONE] arrives before the end of the chunked body. Read to the end so
+    # requests returns the connection to the pool instead of closing it.
+    for _ in chunks:
+        pass
@@ -3,6 +3,10 @@ import os
 import sys
 from openai import OpenAI
 
+# The model catalog cache is shared with the chat client in ask-server/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "ask-server"))
+from model_catalog import ModelCatalog
+
 # Load API key
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
@@ -12,12 +16,20 @@ if not api_key:
 # Initialize OpenAI client
 client = OpenAI(api_key=api_key)
 
-# List available models
+def fetch_models(etag=None):
+    # The models endpoint has no ETag, so every fetch returns the full list.
+    return [model.id for model in client.models.list().data], None
+
+catalog = ModelCatalog(str(client.base_url), fetch_models)
+
+# List available models, from the cache unless it is stale or --refresh is given
 try:
-    models = client.models.list()
-    for model in models.data:
-        print(model.id)
+    if "--refresh" in sys.argv[1:] or catalog.stale:
+        models = catalog.refresh()
+    else:
+        models = catalog.models()
+    for model_id in models:
+        print(model_id)
 except Exception as e:
     print(f"❌ Failed to retrieve models: {e}", file=sys.stderr)
     sys.exit(1)
-